@@ -115,6 +115,74 @@ def connect_source_states_signals():
                                 sender=handler.source_states.through,
                                 dispatch_uid='source_states_related_to_handler_delete_cache')
 
+def connect_hook_signals():
+    from . import signals as handlers
+    hook = apps.get_model("permabots", "Hook")
+    signals.post_save.connect(handlers.delete_cache_hook,
+                              sender=hook,
+                              dispatch_uid='hook_delete_cache')
+
+def connect_config_signals():
+    from . import signals as handlers
+    for model_name in ('State', 'Hook'):
+        sender = apps.get_model("permabots", model_name)
+        signals.post_save.connect(handlers.bump_config_version,
+                                  sender=sender,
+                                  dispatch_uid='%s_bump_config_version' % model_name.lower())
+        signals.post_delete.connect(handlers.bump_config_version,
+                                    sender=sender,
+                                    dispatch_uid='%s_bump_config_version' % model_name.lower())
+    for model_name in ('Response', 'Request'):
+        sender = apps.get_model("permabots", model_name)
+        signals.post_save.connect(handlers.bump_config_version_handler,
+                                  sender=sender,
+                                  dispatch_uid='%s_bump_config_version' % model_name.lower())
+    for model_name in ('UrlParam', 'HeaderParam'):
+        sender = apps.get_model("permabots", model_name)
+        signals.post_save.connect(handlers.bump_config_version_param,
+                                  sender=sender,
+                                  dispatch_uid='%s_bump_config_version' % model_name.lower())
+        signals.post_delete.connect(handlers.bump_config_version_param,
+                                    sender=sender,
+                                    dispatch_uid='%s_bump_config_version' % model_name.lower())
+
+def connect_templates_signals():
+    from . import signals as handlers
+    for model_name in ('Response', 'Request', 'UrlParam', 'HeaderParam'):
+        sender = apps.get_model("permabots", model_name)
+        signals.post_save.connect(handlers.compile_templates,
+                                  sender=sender,
+                                  dispatch_uid='%s_compile_templates' % model_name.lower())
+        signals.post_delete.connect(handlers.delete_cache_templates,
+                                    sender=sender,
+                                    dispatch_uid='%s_delete_cache_templates' % model_name.lower())
+
+def connect_chat_states_signals():
+    from . import signals as handlers
+    for model_name in ('TelegramChatState', 'KikChatState', 'MessengerChatState'):
+        sender = apps.get_model("permabots", model_name)
+        signals.post_save.connect(handlers.set_cache_chat_state,
+                                  sender=sender,
+                                  dispatch_uid='%s_set_cache' % model_name.lower())
+    # Chat states deleted in cascade are sent as ChatState
+    for model_name in ('ChatState', 'TelegramChatState', 'KikChatState', 'MessengerChatState'):
+        signals.post_delete.connect(handlers.delete_cache_chat_state,
+                                    sender=apps.get_model("permabots", model_name),
+                                    dispatch_uid='%s_delete_cache' % model_name.lower())
+    # Cached chat states keep their state
+    state = apps.get_model("permabots", "State")
+    signals.post_save.connect(handlers.delete_cache_state_chat_states,
+                              sender=state,
+                              dispatch_uid='state_delete_cache_chat_states')
+    signals.pre_delete.connect(handlers.delete_cache_state_chat_states,
+                               sender=state,
+                               dispatch_uid='state_delete_cache_chat_states')
+    # Chat states keep chats and users keys instead of foreign keys
+    for model_name in ('Chat', 'User', 'KikChat', 'KikUser'):
+        signals.post_delete.connect(handlers.delete_chat_states,
+                                    sender=apps.get_model("permabots", model_name),
+                                    dispatch_uid='%s_delete_chat_states' % model_name.lower())
+
 class PermabotsAppConfig(AppConfig):
     name = "permabots"
     verbose_name = "Permabots"
@@ -129,3 +197,7 @@ class PermabotsAppConfig(AppConfig):
         connect_environment_vars_signals()
         connect_handlers_signals()
         connect_source_states_signals()
+        connect_config_signals()
+        connect_hook_signals()
+        connect_templates_signals()
+        connect_chat_states_signals()
@@ -0,0 +1,91 @@
+from django.core.cache import cache
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+#  Seconds an item waits in a buffer before it is discarded
+ITEM_TIMEOUT = 3600
+
+
+def enabled():
+    return getattr(settings, 'PERMABOTS_BATCH_TASKS', False)
+
+def window():
+    """
+    Seconds items are collected before processing them together.
+    """
+    return getattr(settings, 'PERMABOTS_BATCH_WINDOW', 0.5)
+
+def _key(name, bot_id, suffix):
+    return 'permabots.batch.{}.{}-{}'.format(name, suffix, bot_id)
+
+def push(name, bot_id, item):
+    """
+    Add an item to the buffer of the bot. i.e. an id
+
+    :returns: True if no flush is pending and caller must schedule one
+    """
+    sequence_key = _key(name, bot_id, 'sequence')
+    cache.add(sequence_key, 0, None)
+    index = cache.incr(sequence_key)
+    cache.set(_key(name, bot_id, 'item_%d' % index), item, ITEM_TIMEOUT)
+    return cache.add(_key(name, bot_id, 'flush'), True, ITEM_TIMEOUT)
+
+def pending(name, bot_id):
+    """
+    Number of items in the buffer of the bot.
+    """
+    done = cache.get(_key(name, bot_id, 'done')) or 0
+    last = cache.get(_key(name, bot_id, 'sequence')) or 0
+    return last - done if last >= done else last
+
+def pop_all(name, bot_id):
+    """
+    Take every buffered item of the bot in arrival order.
+
+    Items are taken up to the first one not stored yet by a concurrent push, which is left for the next flush.
+    An item still missing in the next flush was lost and it is skipped.
+
+    :returns: list of items or None if other process is taking them
+    """
+    lock_key = _key(name, bot_id, 'lock')
+    if not cache.add(lock_key, True, 60):
+        return None
+    try:
+        cache.delete(_key(name, bot_id, 'flush'))
+        done_key = _key(name, bot_id, 'done')
+        missing_key = _key(name, bot_id, 'missing')
+        done = cache.get(done_key) or 0
+        last = cache.get(_key(name, bot_id, 'sequence')) or 0
+        missing = cache.get(missing_key)
+        if last < done:
+            #  Sequence evicted and started again
+            done = 0
+            missing = None
+        first = done + 1
+        item_keys = [_key(name, bot_id, 'item_%d' % index) for index in range(first, last + 1)]
+        items = cache.get_many(item_keys)
+        taken = []
+        for index, key in enumerate(item_keys, first):
+            if key in items:
+                taken.append(items[key])
+            elif index == missing:
+                logger.error("Item %s of %s batch for bot %s lost" % (index, name, bot_id))
+            else:
+                cache.set(missing_key, index, ITEM_TIMEOUT)
+                break
+            done = index
+        cache.set(done_key, done, None)
+        cache.delete_many(item_keys[:done - first + 1])
+        return taken
+    finally:
+        cache.delete(lock_key)
+
+def reschedule(name, bot_id):
+    """
+    Items left in the buffer of the bot by last pop.
+
+    :returns: True if no flush is pending and caller must schedule one
+    """
+    return pending(name, bot_id) > 0 and cache.add(_key(name, bot_id, 'flush'), True, ITEM_TIMEOUT)
@@ -1,35 +1,214 @@
 from django.core.cache import cache
+from django.conf import settings
+from collections import OrderedDict
+from permabots import metrics
+import threading
+import time
+import uuid
 
+#  Cached instead of None to know an object does not exist without querying DB
+NOT_FOUND = 'permabots.caching.not_found'
+
+#  Bots also kept in a process local tier by model name. Configuration snapshots are kept by :mod:`permabots.snapshot`
+LOCAL_FAMILIES = ('bot', 'telegrambot', 'kikbot', 'messengerbot')
+#  Bumped when some local entry changes so every process drops its local tier
+LOCAL_VERSION_KEY = 'permabots.caching.local_version'
+
+#  Process local entries (value, expiration) in least recently used order
+_local = OrderedDict()
+_local_lock = threading.Lock()
+_local_version = {'version': None, 'checked': 0}
+
+
+def local_size():
+    """
+    Max entries in process local tier. Disabled with 0.
+    """
+    return getattr(settings, 'PERMABOTS_LOCAL_CACHE_SIZE', 0)
+
+def local_timeout():
+    """
+    Seconds an entry is kept in process local tier.
+    """
+    return getattr(settings, 'PERMABOTS_LOCAL_CACHE_TIMEOUT', 60)
+
+def local_check_interval():
+    """
+    Seconds between checks of the shared version. Changes take up to this time to reach other processes.
+    """
+    return getattr(settings, 'PERMABOTS_LOCAL_CACHE_CHECK_INTERVAL', 1)
+
+def _check_local_version(now):
+    if now - _local_version['checked'] < local_check_interval():
+        return _local_version['version']
+    version = cache.get(LOCAL_VERSION_KEY)
+    if version is None:
+        cache.add(LOCAL_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(LOCAL_VERSION_KEY)
+    with _local_lock:
+        if version != _local_version['version']:
+            _local.clear()
+            _local_version['version'] = version
+        _local_version['checked'] = now
+    return version
+
+def local_get(key):
+    """
+    Entry from process local tier. None if not found, expired or local tier is disabled.
+    """
+    if not local_size():
+        return None
+    now = time.time()
+    _check_local_version(now)
+    with _local_lock:
+        entry = _local.pop(key, None)
+        if entry is None or entry[1] < now:
+            return None
+        _local[key] = entry
+        return entry[0]
+
+def local_set(key, value, version):
+    """
+    Keep entry in process local tier if version did not change since it was read from shared cache or DB.
+    """
+    size = local_size()
+    if not size or version != _local_version['version']:
+        return
+    with _local_lock:
+        _local.pop(key, None)
+        _local[key] = (value, time.time() + local_timeout())
+        while len(_local) > size:
+            _local.popitem(last=False)
+
+def local_version():
+    """
+    Shared version before reading an entry to keep it in local tier.
+    """
+    if not local_size():
+        return None
+    return _check_local_version(time.time())
+
+def invalidate_local():
+    """
+    Drop local tier of this process and bump shared version so other processes drop their local tier.
+    """
+    with _local_lock:
+        _local.clear()
+    cache.set(LOCAL_VERSION_KEY, uuid.uuid4().hex, None)
+    
+def clear_local():
+    with _local_lock:
+        _local.clear()
+        _local_version.update(version=None, checked=0)
+
+def not_found_timeout():
+    """
+    Seconds an object not found is remembered so it is not looked up again in DB. Disabled with 0.
+    """
+    return getattr(settings, 'PERMABOTS_NOT_FOUND_TIMEOUT', 30)
+
+def set_not_found(key):
+    timeout = not_found_timeout()
+    if timeout:
+        cache.set(key, NOT_FOUND, timeout)
+        
+def is_not_found(key):
+    return cache.get(key) == NOT_FOUND
+
+def is_local(model):
+    return model._meta.model_name in LOCAL_FAMILIES
 
 def generate_key(model, pk, related=None):
     if related:
         return '{}.{}.{}-{}'.format(model._meta.app_label, model._meta.model_name, related, pk)
     return '{}.{}-{}'.format(model._meta.app_label, model._meta.model_name, pk)
 
+def config_version_key(bot_id):
+    return 'permabots.caching.config_version-{}'.format(bot_id)
+
+def config_version(bot):
+    """
+    Version of the bot configuration shared by all processes. Entries derived from the configuration embed it
+    in their keys, so they are not used anymore once it changes and nothing is deleted.
+    """
+    key = config_version_key(bot.pk)
+    version = local_get(key)
+    if version is None:
+        local = local_version()
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, None)
+            version = cache.get(key)
+        local_set(key, version, local)
+    return version
+
+def bump_config_version(bot):
+    """
+    Change the configuration version when a handler, state, env var or hook of the bot changes.
+    """
+    key = config_version_key(bot.pk)
+    cache.set(key, uuid.uuid4().hex, None)
+    if local_size():
+        invalidate_local()
+
 def get_or_set(model, pk):
     key = generate_key(model, pk)
+    family = model._meta.model_name
+    local = is_local(model)
+    if local:
+        obj = local_get(key)
+        if obj is not None:
+            metrics.hit(family, local=True)
+            return obj
+        version = local_version()
     obj = cache.get(key)
-    if not obj:
-        obj = model.objects.get(pk=pk)
+    if obj == NOT_FOUND:
+        metrics.hit(family)
+        raise model.DoesNotExist("%s %s not found in cache" % (model._meta.object_name, pk))
+    if obj:
+        metrics.hit(family)
+    else:
+        started = time.time()
+        try:
+            obj = model.objects.get(pk=pk)
+        except model.DoesNotExist:
+            set_not_found(key)
+            metrics.miss(family, started)
+            raise
         cache.set(key, obj)
+        metrics.miss(family, started, obj)
+    if local:
+        local_set(key, obj, version)
     return obj
 
 def get(model, pk):
     key = generate_key(model, pk)
-    return cache.get(key)
+    obj = cache.get(key)
+    return None if obj == NOT_FOUND else obj
 
 def delete(model, instance, related=None):
     key = generate_key(model, instance.pk, related)
-    cache.delete(key)    
+    cache.delete(key)
+    if not related and is_local(model):
+        invalidate_local()
     
 def set(obj):
     key = generate_key(obj._meta.model, obj.pk)
     cache.set(key, obj)
     
-def get_or_set_related(instance, related, *args):
-    key = generate_key(instance._meta.model, instance.pk, related)
-    objs = cache.get(key)
-    if objs is None:
-        objs = getattr(instance, related).select_related(*args).all()
-        cache.set(key, objs)
-    return objs
\ No newline at end of file
+def get_or_set_lookup(key, lookup, family='lookup'):
+    """
+    Object found by lookup callable cached with key. None if lookup returns None.
+    """
+    obj = cache.get(key)
+    if obj is None:
+        started = time.time()
+        obj = lookup()
+        cache.set(key, NOT_FOUND if obj is None else obj)
+        metrics.miss(family, started, obj)
+    else:
+        metrics.hit(family)
+    return None if obj == NOT_FOUND else obj
+    
+def set_many(objs):
+    cache.set_many(dict((generate_key(obj._meta.model, obj.pk), obj) for obj in objs))
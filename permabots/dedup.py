@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.cache import cache
+
+
+def timeout():
+    """
+    Seconds a received message is remembered to discard redeliveries. Disabled with None.
+    """
+    return getattr(settings, 'PERMABOTS_DEDUP_TIMEOUT', None)
+
+def _key(service, bot_id, message_key):
+    return 'permabots.seen.{}.{}-{}'.format(service, bot_id, message_key)
+
+def seen(service, bot_id, message_key):
+    """
+    Mark message as received.
+
+    :param service: Service identity i.e. telegram
+    :param bot_id: Integration bot receiving the message
+    :param message_key: Identifier of the message in the service i.e. Telegram update_id
+    :returns: True if message was already received
+    """
+    if timeout() is None:
+        return False
+    #  add is atomic so only one of concurrent redeliveries is accepted
+    return not cache.add(_key(service, bot_id, message_key), True, timeout())
+
+def forget(service, bot_id, message_key):
+    """
+    Accept again a message. i.e. when it could not be processed and provider will redeliver it.
+    """
+    if timeout() is not None:
+        cache.delete(_key(service, bot_id, message_key))
@@ -0,0 +1,163 @@
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from permabots.models import TelegramUser, TelegramChat, TelegramMessage, TelegramUpdate, TelegramCallbackQuery
+from datetime import datetime
+from permabots import batching
+import logging
+
+logger = logging.getLogger(__name__)
+
+#  Write-behind buffer of Telegram updates processed by fast path
+BUFFER = 'telegram_persist'
+BUFFER_KEY = 'all'
+
+
+def fast_path_enabled():
+    """
+    Telegram updates are processed from webhook data without writing them on the webhook request.
+    """
+    return getattr(settings, 'PERMABOTS_TELEGRAM_FAST_PATH', False)
+
+def _build_message(data):
+    return TelegramMessage(message_id=data['message_id'],
+                           from_user=TelegramUser(**data['from']),
+                           date=datetime.fromtimestamp(data['date']),
+                           chat=TelegramChat(**data['chat']),
+                           text=data.get('text'))
+
+def build_update(data, bot):
+    """
+    Build in memory the update serialized by :class:`UpdateSerializer <permabots.serializers.telegram_api.UpdateSerializer>`.
+    Nothing is read or written in DB.
+
+    :returns: Unsaved update or None if it is not a text message or callback query
+    """
+    if 'message' in data:
+        if 'text' not in data['message']:
+            return None
+        return TelegramUpdate(bot=bot, update_id=data['update_id'], message=_build_message(data['message']))
+    elif 'callback_query' in data:
+        # Message may be not present if it is very old
+        if 'message' in data['callback_query']:
+            message = _build_message(data['callback_query']['message'])
+        else:
+            message = None
+        callback_query = TelegramCallbackQuery(callback_id=data['callback_query']['id'],
+                                               from_user=TelegramUser(**data['callback_query']['from']),
+                                               message=message,
+                                               data=data['callback_query']['data'])
+        return TelegramUpdate(bot=bot, update_id=data['update_id'], callback_query=callback_query)
+    return None
+
+def batch_size():
+    """
+    Buffered updates stored as soon as this number is reached.
+    """
+    return getattr(settings, 'PERMABOTS_PERSIST_BATCH_SIZE', 500)
+
+def window():
+    """
+    Seconds buffered updates wait before being stored if batch size is not reached.
+    """
+    return getattr(settings, 'PERMABOTS_PERSIST_WINDOW', 1)
+
+def max_retries():
+    """
+    Times buffered updates are buffered again when storing them fails before they are discarded.
+    """
+    return getattr(settings, 'PERMABOTS_PERSIST_MAX_RETRIES', 3)
+
+def buffer_update(bot_id, data, retries=0):
+    """
+    Add update data to the write-behind buffer shared by all bots.
+
+    :param retries: Times storing the update failed
+    :returns: (flush_later, flush_now). flush_later if no flush is pending, flush_now if batch size is reached
+    """
+    flush_later = batching.push(BUFFER, BUFFER_KEY, (bot_id, data, retries))
+    pending = batching.pending(BUFFER, BUFFER_KEY)
+    return flush_later, pending > 0 and pending % batch_size() == 0
+
+def _get_or_create(instance):
+    fields = dict((field.attname, getattr(instance, field.attname))
+                  for field in instance._meta.concrete_fields if not field.primary_key)
+    type(instance).objects.get_or_create(pk=instance.pk, defaults=fields)
+
+def save_if_new(instance):
+    """
+    Create in DB the user or chat built in memory if it does not exist yet.
+    """
+    if instance._state.adding:
+        _get_or_create(instance)
+        instance._state.adding = False
+
+def _create_missing(model, instances):
+    existing = set(model.objects.filter(pk__in=instances.keys()).values_list('pk', flat=True))
+    missing = [instance for pk, instance in instances.items() if pk not in existing]
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(missing, batch_size=batch_size())
+    except IntegrityError:
+        # Some of them created meanwhile by other process
+        for instance in missing:
+            _get_or_create(instance)
+
+def _create_update(update):
+    try:
+        with transaction.atomic():
+            for message in (update.message, update.callback_query and update.callback_query.message):
+                if message:
+                    for instance in (message.from_user, message.chat):
+                        _get_or_create(instance)
+                    message.save()
+            if update.callback_query:
+                _get_or_create(update.callback_query.from_user)
+                update.callback_query.save()
+            update.save()
+    except IntegrityError:
+        logger.warning("Update %s already stored" % update)
+    except Exception:
+        logger.exception("Update %s of bot %s not stored. Discarded" % (update.update_id, update.bot_id))
+
+def _bulk_create(updates):
+    users, chats, messages, callback_queries = {}, {}, [], []
+    for update in updates:
+        if update.callback_query:
+            users.setdefault(update.callback_query.from_user.pk, update.callback_query.from_user)
+            callback_queries.append(update.callback_query)
+        for message in (update.message, update.callback_query and update.callback_query.message):
+            if message:
+                users.setdefault(message.from_user.pk, message.from_user)
+                chats.setdefault(message.chat.pk, message.chat)
+                messages.append(message)
+    _create_missing(TelegramUser, users)
+    _create_missing(TelegramChat, chats)
+    with transaction.atomic():
+        TelegramMessage.objects.bulk_create(messages, batch_size=batch_size())
+        TelegramCallbackQuery.objects.bulk_create(callback_queries, batch_size=batch_size())
+        TelegramUpdate.objects.bulk_create(updates, batch_size=batch_size())
+
+def persist_updates(updates):
+    """
+    Store updates built in memory with a few bulk inserts.
+
+    Users and chats already stored are kept. Messages and callback queries got their ids when built.
+    If bulk inserts fail, i.e. some update was stored meanwhile by other process, updates are stored one by one
+    and those failing are discarded.
+    """
+    stored = set(TelegramUpdate.objects.filter(bot__in=set(update.bot_id for update in updates),
+                                               update_id__in=[update.update_id for update in updates]).values_list('bot', 'update_id'))
+    new_updates = []
+    for update in updates:
+        #  Redelivered updates are stored once
+        if (update.bot_id, update.update_id) not in stored:
+            stored.add((update.bot_id, update.update_id))
+            new_updates.append(update)
+    try:
+        _bulk_create(new_updates)
+    except Exception:
+        #  Updates failing alone are discarded so they do not block the others
+        logger.warning("Bulk store of %s updates failed. Stored one by one" % len(new_updates))
+        for update in new_updates:
+            _create_update(update)
+    logger.debug("Stored %s updates" % len(new_updates))
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from permabots.models import Bot, TelegramChatState, KikChatState, MessengerChatState
+
+
+class Command(BaseCommand):
+    help = "Remove context of chat states exceeding context limits of their bots"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--bot', dest='bot', default=None, help="Only compact chat states of this bot id")
+        
+    def handle(self, *args, **options):
+        bots = Bot.objects.all()
+        if options['bot']:
+            bots = bots.filter(pk=options['bot'])
+            if not bots.exists():
+                raise CommandError("Bot %s does not exist" % options['bot'])
+        compacted = 0
+        for bot in bots:
+            policy = bot.context_policy()
+            if all(value is None for value in policy.values()):
+                continue
+            for model in (TelegramChatState, KikChatState, MessengerChatState):
+                for chat_state in model.objects.filter(bot=bot).select_related('state').iterator():
+                    if chat_state.prune_context(**policy):
+                        chat_state.save(update_fields=chat_state.save_context_changes())
+                        compacted += 1
+        self.stdout.write("%s chat states compacted" % compacted)
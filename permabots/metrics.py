@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+from six.moves import cPickle as pickle
+import logging
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+#  Backends instantiated by dotted path
+_backends = {}
+
+
+class MetricsBackend(object):
+    """
+    Receives cache metrics of each key family. i.e. bot, telegrambot, handlers, update
+
+    Metrics:
+        * hits: found in cache backend
+        * local_hits: found in process local tier
+        * misses: not found in cache and filled from DB
+        * payload_bytes: pickled size of the objects filled
+        * fill: seconds spent filling misses
+    """
+    def incr(self, metric, family, value=1):
+        raise NotImplementedError
+
+    def timing(self, metric, family, seconds):
+        raise NotImplementedError
+
+
+class MemoryBackend(MetricsBackend):
+    """
+    Metrics kept in memory of this process. Exported by :class:`PrometheusMetricsView <permabots.views.metrics.PrometheusMetricsView>`.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def incr(self, metric, family, value=1):
+        with self._lock:
+            key = (metric, family)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def timing(self, metric, family, seconds):
+        with self._lock:
+            count, total = self.timings.get((metric, family), (0, 0.0))
+            self.timings[(metric, family)] = (count + 1, total + seconds)
+
+    def collect(self):
+        """
+        :returns: (counters, timings) with (metric, family) keys. Timings are (count, sum of seconds)
+        """
+        with self._lock:
+            return dict(self.counters), dict(self.timings)
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.timings = {}
+
+
+class StatsdBackend(MetricsBackend):
+    """
+    Metrics sent to StatsD by UDP as ``<prefix>.<family>.<metric>``. Configured with PERMABOTS_STATSD_HOST,
+    PERMABOTS_STATSD_PORT and PERMABOTS_STATSD_PREFIX.
+    """
+    def __init__(self):
+        self.address = (getattr(settings, 'PERMABOTS_STATSD_HOST', 'localhost'),
+                        getattr(settings, 'PERMABOTS_STATSD_PORT', 8125))
+        self.prefix = getattr(settings, 'PERMABOTS_STATSD_PREFIX', 'permabots.cache')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, metric, family, value, kind):
+        data = '{}.{}.{}:{}|{}'.format(self.prefix, family, metric, value, kind)
+        try:
+            self.socket.sendto(data.encode('utf-8'), self.address)
+        except socket.error:
+            logger.warning("Metric %s not sent to statsd" % data)
+
+    def incr(self, metric, family, value=1):
+        self.send(metric, family, value, 'c')
+
+    def timing(self, metric, family, seconds):
+        self.send(metric, family, int(round(seconds * 1000)), 'ms')
+
+
+def get_backend():
+    """
+    Backend configured with PERMABOTS_METRICS_BACKEND dotted path, i.e. 'permabots.metrics.MemoryBackend'.
+
+    :returns: Backend instance shared by the process or None if metrics are disabled
+    """
+    path = getattr(settings, 'PERMABOTS_METRICS_BACKEND', None)
+    if not path:
+        return None
+    backend = _backends.get(path)
+    if backend is None:
+        backend = _backends.setdefault(path, import_string(path)())
+    return backend
+
+def hit(family, local=False):
+    backend = get_backend()
+    if backend:
+        backend.incr('local_hits' if local else 'hits', family)
+
+def miss(family, started, obj=None):
+    """
+    Record an object filled in cache.
+
+    :param started: time.time() when filling started
+    :param obj: Object filled. Its pickled size is recorded
+    """
+    backend = get_backend()
+    if backend:
+        backend.incr('misses', family)
+        backend.timing('fill', family, time.time() - started)
+        if obj is not None:
+            backend.incr('payload_bytes', family, len(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)))
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permabots', '0007_auto_20160530_0455'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='request',
+            name='cache_timeout',
+            field=models.PositiveIntegerField(blank=True, help_text='Seconds GET responses are cached. Set none to not cache them', null=True, verbose_name='Cache timeout'),
+        ),
+        migrations.AddField(
+            model_name='request',
+            name='cache_stale_timeout',
+            field=models.PositiveIntegerField(default=0, help_text='Seconds an expired cached response is still used while it is refreshed', verbose_name='Cache stale timeout'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import permabots.models.fields
+
+
+def empty_context_to_null(apps, schema_editor):
+    for model_name in ('TelegramChatState', 'KikChatState', 'MessengerChatState'):
+        apps.get_model('permabots', model_name).objects.filter(context='').update(context=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permabots', '0008_request_cache_timeout'),
+    ]
+
+    operations = [
+        migrations.RunPython(empty_context_to_null, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='telegramchatstate',
+            name='context',
+            field=permabots.models.fields.JSONField(blank=True, help_text='Context serialized to json when this state was set', null=True, verbose_name='Context'),
+        ),
+        migrations.AlterField(
+            model_name='kikchatstate',
+            name='context',
+            field=permabots.models.fields.JSONField(blank=True, help_text='Context serialized to json when this state was set', null=True, verbose_name='Context'),
+        ),
+        migrations.AlterField(
+            model_name='messengerchatstate',
+            name='context',
+            field=permabots.models.fields.JSONField(blank=True, help_text='Context serialized to json when this state was set', null=True, verbose_name='Context'),
+        ),
+    ]
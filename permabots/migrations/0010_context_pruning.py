@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import permabots.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permabots', '0009_chat_state_context_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bot',
+            name='context_max_states',
+            field=models.PositiveIntegerField(blank=True, help_text='States which context is kept for each chat. Set none to keep all', null=True, verbose_name='Context max states'),
+        ),
+        migrations.AddField(
+            model_name='bot',
+            name='context_max_bytes',
+            field=models.PositiveIntegerField(blank=True, help_text='Max json size of the context kept for each chat. Oldest removed first', null=True, verbose_name='Context max bytes'),
+        ),
+        migrations.AddField(
+            model_name='bot',
+            name='context_timeout',
+            field=models.PositiveIntegerField(blank=True, help_text='Seconds the context of a state is kept. Set none to keep it forever', null=True, verbose_name='Context timeout'),
+        ),
+        migrations.AddField(
+            model_name='telegramchatstate',
+            name='context_timestamps',
+            field=permabots.models.fields.JSONField(blank=True, help_text='Unix time when context of each state was set', null=True, verbose_name='Context timestamps'),
+        ),
+        migrations.AddField(
+            model_name='kikchatstate',
+            name='context_timestamps',
+            field=permabots.models.fields.JSONField(blank=True, help_text='Unix time when context of each state was set', null=True, verbose_name='Context timestamps'),
+        ),
+        migrations.AddField(
+            model_name='messengerchatstate',
+            name='context_timestamps',
+            field=permabots.models.fields.JSONField(blank=True, help_text='Unix time when context of each state was set', null=True, verbose_name='Context timestamps'),
+        ),
+    ]
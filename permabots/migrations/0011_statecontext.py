@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import permabots.models.fields
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permabots', '0010_context_pruning'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StateContext',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Date created')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Date updated')),
+                ('chat_state_id', models.UUIDField(db_index=True, help_text='Telegram, Kik or Messenger chat state', verbose_name='Chat State')),
+                ('state_name', models.CharField(max_length=255, verbose_name='State name')),
+                ('context', permabots.models.fields.JSONField(blank=True, help_text='Context serialized to json when this state was set', null=True, verbose_name='Context')),
+            ],
+            options={
+                'verbose_name': 'State Context',
+                'verbose_name_plural': 'State Contexts',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='statecontext',
+            unique_together=set([('chat_state_id', 'state_name')]),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import permabots.models.fields
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permabots', '0011_statecontext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatState',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Date created')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Date updated')),
+                ('service', models.CharField(choices=[('telegram', 'Telegram'), ('kik', 'Kik'), ('messenger', 'Messenger')], help_text='Service of the chat', max_length=32, verbose_name='Service')),
+                ('chat_key', models.CharField(help_text='Chat identifier in the service', max_length=255, verbose_name='Chat key')),
+                ('user_key', models.CharField(blank=True, default='', help_text='User identifier in the service. Empty if chat only identifies the user', max_length=255, verbose_name='User key')),
+                ('context', permabots.models.fields.JSONField(blank=True, help_text='Context serialized to json when this state was set', null=True, verbose_name='Context')),
+                ('context_timestamps', permabots.models.fields.JSONField(blank=True, help_text='Unix time when context of each state was set', null=True, verbose_name='Context timestamps')),
+                ('bot', models.ForeignKey(help_text='Bot which chat state is attached to', on_delete=django.db.models.deletion.CASCADE, related_name='chat_states', to='permabots.Bot', verbose_name='Bot')),
+                ('state', models.ForeignKey(help_text='State related to the chat', on_delete=django.db.models.deletion.CASCADE, related_name='chat_states', to='permabots.State', verbose_name='State')),
+            ],
+            options={
+                'verbose_name': 'Chat State',
+                'verbose_name_plural': 'Chats States',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='chatstate',
+            unique_together=set([('bot', 'service', 'chat_key', 'user_key')]),
+        ),
+    ]
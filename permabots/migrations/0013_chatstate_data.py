@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+SERVICES = (('TelegramChatState', 'telegram'), ('KikChatState', 'kik'), ('MessengerChatState', 'messenger'))
+
+
+def copy_chat_states(apps, schema_editor):
+    ChatState = apps.get_model('permabots', 'ChatState')
+    StateContext = apps.get_model('permabots', 'StateContext')
+    # Keep dates of copied chat states
+    for field in ChatState._meta.fields:
+        if field.name in ('created_at', 'updated_at'):
+            field.auto_now = field.auto_now_add = False
+    for model_name, service in SERVICES:
+        model = apps.get_model('permabots', model_name)
+        has_user = any(field.name == 'user' for field in model._meta.fields)
+        # Messenger chat is not a foreign key
+        chat_attname = model._meta.get_field('chat').attname
+        chat_states = {}
+        # Last updated chat state is kept if some chat has several with the same bot
+        for old in model.objects.select_related('state').order_by('updated_at').iterator():
+            chat_key = str(getattr(old, chat_attname))
+            user_key = str(old.user_id) if has_user else ''
+            chat_states[(old.state.bot_id, chat_key, user_key)] = ChatState(id=old.id,
+                                                                            created_at=old.created_at,
+                                                                            updated_at=old.updated_at,
+                                                                            bot_id=old.state.bot_id,
+                                                                            service=service,
+                                                                            chat_key=chat_key,
+                                                                            user_key=user_key,
+                                                                            state_id=old.state_id,
+                                                                            context=old.context,
+                                                                            context_timestamps=old.context_timestamps)
+        ChatState.objects.bulk_create(chat_states.values(), batch_size=500)
+    StateContext.objects.exclude(chat_state_id__in=ChatState.objects.values('id')).delete()
+
+
+def copy_back_chat_states(apps, schema_editor):
+    ChatState = apps.get_model('permabots', 'ChatState')
+    for model_name, service in SERVICES:
+        model = apps.get_model('permabots', model_name)
+        has_user = any(field.name == 'user' for field in model._meta.fields)
+        chat_attname = model._meta.get_field('chat').attname
+        for chat_state in ChatState.objects.filter(service=service).iterator():
+            old = model(id=chat_state.id, state_id=chat_state.state_id,
+                        context=chat_state.context, context_timestamps=chat_state.context_timestamps)
+            setattr(old, chat_attname, chat_state.chat_key)
+            if has_user:
+                old.user_id = chat_state.user_key
+            old.save()
+    ChatState.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permabots', '0012_chatstate'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_chat_states, copy_back_chat_states),
+    ]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permabots', '0013_chatstate_data'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='TelegramChatState',
+        ),
+        migrations.DeleteModel(
+            name='KikChatState',
+        ),
+        migrations.DeleteModel(
+            name='MessengerChatState',
+        ),
+        migrations.CreateModel(
+            name='TelegramChatState',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'Telegram Chat State',
+                'verbose_name_plural': 'Telegram Chats States',
+                'proxy': True,
+            },
+            bases=('permabots.chatstate',),
+        ),
+        migrations.CreateModel(
+            name='KikChatState',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'Kik Chat State',
+                'verbose_name_plural': 'Kik Chats States',
+                'proxy': True,
+            },
+            bases=('permabots.chatstate',),
+        ),
+        migrations.CreateModel(
+            name='MessengerChatState',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'Messenger Chat State',
+                'verbose_name_plural': 'Messenger Chats States',
+                'proxy': True,
+            },
+            bases=('permabots.chatstate',),
+        ),
+        migrations.AlterUniqueTogether(
+            name='statecontext',
+            unique_together=set([]),
+        ),
+        migrations.RenameField(
+            model_name='statecontext',
+            old_name='chat_state_id',
+            new_name='chat_state',
+        ),
+        migrations.AlterField(
+            model_name='statecontext',
+            name='chat_state',
+            field=models.ForeignKey(help_text='Chat state the context belongs to', on_delete=django.db.models.deletion.CASCADE, related_name='state_contexts', to='permabots.ChatState', verbose_name='Chat State'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='statecontext',
+            unique_together=set([('chat_state', 'state_name')]),
+        ),
+    ]
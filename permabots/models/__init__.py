@@ -5,7 +5,7 @@ from permabots.models.telegram_api import (User as TelegramUser,  # NOQA
                                           CallbackQuery as TelegramCallbackQuery)   # NOQA
 from permabots.models.kik_api import (KikUser, KikChat, KikMessage)  # NOQA
 from permabots.models.messenger_api import MessengerMessage  # NOQA
-from permabots.models.state import State, TelegramChatState, KikChatState, MessengerChatState  # NOQA
+from permabots.models.state import State, ChatState, TelegramChatState, KikChatState, MessengerChatState, StateContext  # NOQA
 from permabots.models.bot import Bot, TelegramBot, KikBot, MessengerBot  # NOQA
 from permabots.models.response import Response  # NOQA
 from permabots.models.handler import Handler, Request, UrlParam, HeaderParam  # NOQA
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from django.db import models
+from django.db import models, transaction
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from telegram import Bot as TelegramBotAPI
@@ -7,8 +7,6 @@ from kik import KikApi
 import logging
 from permabots.models.base import PermabotsModel
 from permabots.models import TelegramUser, TelegramChatState, KikChatState, MessengerChatState
-from django.urls import URLResolver
-from django.urls import Resolver404
 from telegram import ParseMode, ReplyKeyboardHide, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.bot import InvalidToken
 import ast
@@ -20,7 +18,9 @@ from kik.messages.keyboards import SuggestedResponseKeyboard
 from kik.configuration import Configuration
 from messengerbot import MessengerClient, messages
 import sys
+from permabots import routing
 from permabots import caching
+from permabots import snapshot
 from messengerbot.attachments import TemplateAttachment
 from messengerbot.elements import Element, PostbackButton, WebUrlButton
 from messengerbot.templates import GenericTemplate
@@ -55,6 +55,12 @@ class Bot(PermabotsModel):
     messenger_bot = models.OneToOneField('MessengerBot', verbose_name=_("Messenger Bot"), related_name='bot',
                                          on_delete=models.SET_NULL, blank=True, null=True,
                                          help_text=_("Messenger Bot"))
+    context_max_states = models.PositiveIntegerField(_('Context max states'), null=True, blank=True,
+                                                     help_text=_("States which context is kept for each chat. Set none to keep all"))
+    context_max_bytes = models.PositiveIntegerField(_('Context max bytes'), null=True, blank=True,
+                                                    help_text=_("Max json size of the context kept for each chat. Oldest removed first"))
+    context_timeout = models.PositiveIntegerField(_('Context timeout'), null=True, blank=True,
+                                                  help_text=_("Seconds the context of a state is kept. Set none to keep it forever"))
     
     class Meta:
         verbose_name = _('Bot')
@@ -63,6 +69,14 @@ class Bot(PermabotsModel):
     def __str__(self):
         return '%s' % self.name
     
+    def context_policy(self):
+        """
+        Limits of the context kept in chat states of this bot.
+        """
+        return {'max_states': self.context_max_states,
+                'max_bytes': self.context_max_bytes,
+                'timeout': self.context_timeout}
+    
     def update_chat_state(self, bot_service, message, chat_state, target_state, context):
         context_target_state = chat_state.state.name.lower().replace(" ", "_") if chat_state else '_start'
         if not chat_state:
@@ -71,11 +85,12 @@ class Bot(PermabotsModel):
                 bot_service.create_chat_state(message, target_state, {context_target_state: context})
         else:
             if chat_state.state != target_state:                
-                state_context = chat_state.ctx
-                state_context[context_target_state] = context
-                chat_state.ctx = state_context
+                # Context is only serialized when it changes
+                chat_state.set_state_context(context_target_state, context)
+                chat_state.prune_context(**self.context_policy())
                 chat_state.state = target_state
-                chat_state.save()
+                with transaction.atomic():
+                    chat_state.save(update_fields=['state', 'updated_at'] + chat_state.save_context_changes())
                 logger.debug("Chat state updated:%s for message %s with (%s,%s)" % 
                              (target_state, message, chat_state.state, context))
             else:
@@ -91,28 +106,19 @@ class Bot(PermabotsModel):
 
         .. note:: Message content will be extracted by IntegrationBot
         """
-        urlpatterns = []
-        state_context = {}
         chat_state = bot_service.get_chat_state(message)
-        for handler in caching.get_or_set_related(self, 'handlers', 'response', 'request', 'target_state'):
-            if handler.enabled:
-                source_states = caching.get_or_set_related(handler, 'source_states')
-                if chat_state:
-                    state_context = chat_state.ctx
-                if not source_states or (chat_state and chat_state.state in source_states):
-                        urlpatterns.append(handler.urlpattern())
-                    
-        resolver = RegexURLResolver(r'^', urlpatterns)
-        try:
-            resolver_match = resolver.resolve(bot_service.message_text(message))
-        except Resolver404:
+        state_context = chat_state.ctx if chat_state else {}
+        bot_snapshot = snapshot.get(self)
+        match = routing.get_table(self, bot_snapshot).resolve(chat_state.state if chat_state else None, bot_service.message_text(message))
+        if match is None:
             logger.warning("Handler not found for %s" % message)
         else:
-            callback, callback_args, callback_kwargs = resolver_match
-            logger.debug("Calling callback:%s for message %s with %s" % 
-                         (callback, message, callback_kwargs))
-            text, keyboard, target_state, context = callback(self, message=message, service=bot_service.identity, 
-                                                             state_context=state_context, **callback_kwargs)
+            handler, pattern_kwargs = match
+            logger.debug("Calling handler:%s for message %s with %s" % 
+                         (handler, message, pattern_kwargs))
+            text, keyboard, target_state, context = handler.process(self, message=message, service=bot_service.identity, 
+                                                                    state_context=state_context, bot_snapshot=bot_snapshot,
+                                                                    **pattern_kwargs)
             if target_state:
                 self.update_chat_state(bot_service, message, chat_state, target_state, context)
             keyboard = bot_service.build_keyboard(keyboard)
@@ -343,10 +349,13 @@ class TelegramBot(IntegrationBot):
     
     def get_chat_state(self, message):
         chat, user = self._get_chat_and_user(message)
-        try:
-            return TelegramChatState.objects.select_related('state', 'chat', 'user').get(chat=chat, user=user, state__bot=self.bot)
-        except TelegramChatState.DoesNotExist:
-            return None
+        
+        def lookup():
+            try:
+                return TelegramChatState.objects.select_related('state').get(bot=self.bot, chat_key=chat.pk, user_key=user.pk)
+            except TelegramChatState.DoesNotExist:
+                return None
+        return caching.get_or_set_lookup(TelegramChatState.cache_key(self.bot.pk, chat.pk, user.pk), lookup, 'chatstate')
         
     def _create_keyboard_button(self, element):
         if isinstance(element, tuple):
@@ -366,8 +375,13 @@ class TelegramBot(IntegrationBot):
         return built_keyboard
         
     def create_chat_state(self, message, target_state, context):
+        from permabots.ingestion import save_if_new
         chat, user = self._get_chat_and_user(message)
-        TelegramChatState.objects.create(chat=chat,
+        # Update may be built in memory and not stored yet
+        save_if_new(chat)
+        save_if_new(user)
+        TelegramChatState.objects.create(bot=self.bot,
+                                         chat=chat,
                                          user=user,
                                          state=target_state,
                                          ctx=context)
@@ -463,10 +477,13 @@ class KikBot(IntegrationBot):
         return message.body
     
     def get_chat_state(self, message):
-        try:
-            return KikChatState.objects.select_related('state', 'chat', 'user').get(chat=message.chat, user=message.from_user, state__bot=self.bot)
-        except KikChatState.DoesNotExist:
-            return None
+        def lookup():
+            try:
+                return KikChatState.objects.select_related('state').get(bot=self.bot, chat_key=message.chat_id,
+                                                                        user_key=message.from_user_id)
+            except KikChatState.DoesNotExist:
+                return None
+        return caching.get_or_set_lookup(KikChatState.cache_key(self.bot.pk, message.chat_id, message.from_user_id), lookup, 'chatstate')
         
     def _create_keyboard_button(self, element):
         # Extend Kik for Link buttons
@@ -482,7 +499,8 @@ class KikBot(IntegrationBot):
         return built_keyboard
     
     def create_chat_state(self, message, target_state, context):
-        KikChatState.objects.create(chat=message.chat,
+        KikChatState.objects.create(bot=self.bot,
+                                    chat=message.chat,
                                     user=message.from_user,
                                     state=target_state,
                                     ctx=context)
@@ -570,10 +588,12 @@ class MessengerBot(IntegrationBot):
         return message.data
     
     def get_chat_state(self, message):
-        try:
-            return MessengerChatState.objects.select_related('state').get(chat=message.sender, state__bot=self.bot)
-        except MessengerChatState.DoesNotExist:
-            return None
+        def lookup():
+            try:
+                return MessengerChatState.objects.select_related('state').get(bot=self.bot, chat_key=message.sender)
+            except MessengerChatState.DoesNotExist:
+                return None
+        return caching.get_or_set_lookup(MessengerChatState.cache_key(self.bot.pk, message.sender), lookup, 'chatstate')
         
     def _create_keyboard_button(self, element):
         if isinstance(element, tuple):
@@ -592,7 +612,8 @@ class MessengerBot(IntegrationBot):
         return built_keyboard
     
     def create_chat_state(self, message, target_state, context):
-        MessengerChatState.objects.create(chat=message.sender,
+        MessengerChatState.objects.create(bot=self.bot,
+                                          chat=message.sender,
                                           state=target_state,
                                           ctx=context)
 
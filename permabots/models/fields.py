@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+import json
+import six
+
+
+class JSONFormField(forms.CharField):
+    widget = forms.Textarea
+    
+    def prepare_value(self, value):
+        if value is None or isinstance(value, six.string_types):
+            return value
+        return json.dumps(value)
+    
+    def to_python(self, value):
+        value = super(JSONFormField, self).to_python(value)
+        if not value:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            raise ValidationError(_("Enter valid JSON"), code='invalid')
+
+
+class JSONField(models.TextField):
+    """
+    Field storing a json value. Native jsonb column in PostgreSQL and text in other databases.
+    
+    Values are decoded once when loaded from DB.
+    """
+    
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'jsonb'
+        return super(JSONField, self).db_type(connection)
+    
+    def from_db_value(self, value, *args):
+        return self.to_python(value)
+    
+    def to_python(self, value):
+        if isinstance(value, six.string_types):
+            if not value:
+                return None
+            try:
+                return json.loads(value)
+            except ValueError:
+                raise ValidationError(_("Enter valid JSON"), code='invalid')
+        #  Already decoded. i.e. jsonb from psycopg2
+        return value
+    
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        if isinstance(value, six.string_types):
+            #  Assigned already serialized
+            value = self.to_python(value)
+        return json.dumps(value)
+    
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj))
+    
+    def formfield(self, **kwargs):
+        defaults = {'form_class': JSONFormField}
+        defaults.update(kwargs)
+        return super(JSONField, self).formfield(**defaults)
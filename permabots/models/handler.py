@@ -4,15 +4,13 @@ from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from permabots.models.base import PermabotsModel
 from permabots.models import Bot, Response
-from jinja2 import Environment
-import requests
-from django.conf.urls import url
 import json
 import logging
 from permabots import validators
 from rest_framework.status import is_success
-from permabots import caching 
-from permabots import utils
+from permabots import snapshot
+from permabots import templating
+from permabots import sessions
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +23,7 @@ class AbstractParam(PermabotsModel):
     key = models.CharField(_('Key'), max_length=255, help_text=_("Name of the parameter"))
     value_template = models.CharField(_('Value template'), max_length=255, validators=[validators.validate_template], 
                                       help_text=_("Value template of the parameter. In jinja2 format. http://jinja.pocoo.org/"))
+    template_fields = ('value_template',)
     
     class Meta:
         abstract = True
@@ -40,9 +39,7 @@ class AbstractParam(PermabotsModel):
         
         :param context: Processing context
         """
-        env = Environment(extensions=['jinja2_time.TimeExtension'])        
-        value_template = env.from_string(self.value_template)
-        return value_template.render(**context) 
+        return templating.render(self, self.value_template, context)
 
 @python_2_unicode_compatible
 class Request(PermabotsModel):
@@ -62,6 +59,13 @@ class Request(PermabotsModel):
     method = models.CharField(_("Method"), max_length=128, default=GET, choices=METHOD_CHOICES, help_text=_("Define Http method for the request"))
     data = models.TextField(null=True, blank=True, verbose_name=_("Data of the request"), help_text=_("Set POST/PUT/PATCH data in json format"),
                             validators=[validators.validate_template])
+    cache_timeout = models.PositiveIntegerField(_("Cache timeout"), null=True, blank=True,
+                                                help_text=_("Seconds GET responses are cached. Set none to not cache them"))
+    cache_stale_timeout = models.PositiveIntegerField(_("Cache stale timeout"), default=0,
+                                                      help_text=_("Seconds an expired cached response is still used while it is refreshed"))
+    template_fields = ('url_template', 'data')
+    #  Parameters by related name when loaded from a bot snapshot
+    snapshot_params = None
     
     class Meta:
         verbose_name = _('Request')
@@ -71,56 +75,73 @@ class Request(PermabotsModel):
         return "%s(%s)" % (self.method, self.url_template)
     
     def _get_method(self):
-        method = {self.GET: requests.get,
-                  self.POST: requests.post,
-                  self.PUT: requests.put,
-                  self.PATCH: requests.patch,
-                  self.DELETE: requests.delete}
+        method = {self.GET: 'GET',
+                  self.POST: 'POST',
+                  self.PUT: 'PUT',
+                  self.PATCH: 'PATCH',
+                  self.DELETE: 'DELETE'}
         try:
             return method[self.method]
         except KeyError:
             logger.error("Method %s not valid" % self.method)
             return method[self.GET]
     
+    def _params(self, related):
+        if self.snapshot_params is not None:
+            return self.snapshot_params[related]
+        return getattr(self, related).all()
+    
     def _url_params(self, **context):
         params = {}
-        for param in self.url_parameters.all():
+        for param in self._params('url_parameters'):
             params[param.key] = param.process(**context)
         return params
     
     def _header_params(self, **context):
         headers = {}
-        for header in self.header_parameters.all():
+        for header in self._params('header_parameters'):
             headers[header.key] = header.process(**context)
         return headers
     
     def data_required(self):
         return self.method != self.GET and self.method != self.DELETE
     
-    def process(self, **context):
+    def cacheable(self):
+        return self.method == self.GET and bool(self.cache_timeout)
+    
+    def cache_stats(self):
+        """
+        Response cache counters.
+        
+        :returns: dict with hits, misses and stale hits
+        """
+        return sessions.get_cache_stats(self)
+    
+    def process(self, bot=None, **context):
         """
         Process handler request. Before executing requests render templates with context
         
+        :param bot: Bot performing the request. Used to limit its concurrent requests
+        :type Bot: :class:`Bot <permabots.models.bot.Bot>`
         :param context: Processing context
         :returns: Requests response `<http://docs.python-requests.org/en/master/api/#requests.Response>` _.
         """
-        env = Environment(extensions=['jinja2_time.TimeExtension'])
-        
-        url_template = env.from_string(self.url_template)
-        url = url_template.render(**context).replace(" ", "")
+        url = templating.render(self, self.url_template, context).replace(" ", "")
         logger.debug("Request %s generates url %s" % (self, url))        
         params = self._url_params(**context)
         logger.debug("Request %s generates params %s" % (self, params))
         headers = self._header_params(**context)
         logger.debug("Request %s generates header %s" % (self, headers))
         
+        bot_id = bot.pk if bot else None
         if self.data_required():
-            data_template = env.from_string(self.data)
-            data = data_template.render(**context)
+            data = templating.render(self, self.data, context)
             logger.debug("Request %s generates data %s" % (self, data))
-            r = self._get_method()(url, data=json.loads(data), headers=headers, params=params)
+            r = sessions.request(self._get_method(), url, bot_id=bot_id, data=json.loads(data), headers=headers, params=params)
+        elif self.cacheable():
+            r = sessions.cached_request(self, url, bot_id=bot_id, headers=headers, params=params)
         else:
-            r = self._get_method()(url, headers=headers, params=params)
+            r = sessions.request(self._get_method(), url, bot_id=bot_id, headers=headers, params=params)
 
         return r
     
@@ -176,10 +197,7 @@ class Handler(PermabotsModel):
     def __str__(self):
         return "%s" % self.name
     
-    def urlpattern(self):
-        return url(self.pattern, self.process)
-                
-    def process(self, bot, message, service, state_context, **pattern_context):
+    def process(self, bot, message, service, state_context, bot_snapshot=None, **pattern_context):
         """
         Process conversation message.
         
@@ -189,7 +207,7 @@ class Handler(PermabotsModel):
             * pattern: url pattern dict
             * env: dict of environment variables associated to this bot
             * message: provider message
-            * emoji: dict of emojis  use named notation with underscores `<http://apps.timwhitlock.info/emoji/tables/unicode>` _.
+            * emoji: dict of emojis  use named notation with underscores `<http://apps.timwhitlock.info/emoji/tables/unicode>` _. Available as template global.
             
         2. Process request (if required)
         
@@ -204,23 +222,22 @@ class Handler(PermabotsModel):
         :type service: string
         :param state_context: Previous contexts
         :type state_context: dict
+        :param bot_snapshot: Configuration of the bot. Obtained if not provided
+        :type bot_snapshot: :class:`BotSnapshot <permabots.snapshot.BotSnapshot>`
         :param pattern_context: Dict variables obtained from handler pattern regular expression.
         :type pattern_context: dict
         :returns: Text and keyboard response, new state for the chat and context used.
         """
-        env = {}
-        for env_var in caching.get_or_set_related(bot, 'env_vars'):
-            env.update(env_var.as_json())
+        env = (bot_snapshot or snapshot.get(bot)).env
         context = {'service': service,
                    'state_context': state_context,
                    'pattern': pattern_context,
                    'env': env,
-                   'message': message.to_dict(),
-                   'emoji': utils.create_emoji_context()}
+                   'message': message.to_dict()}
         response_context = {}
         success = True
         if self.request:
-            r = self.request.process(**context)
+            r = self.request.process(bot, **context)
             logger.debug("Handler %s get request %s" % (self, r))        
             success = is_success(r.status_code)
             response_context['status'] = r.status_code
@@ -236,7 +253,6 @@ class Handler(PermabotsModel):
             context.pop('env', None)
             context.pop('state_context', None)
             context.pop('service', None)
-            context.pop('emoji', None)
             target_state = self.target_state
         else:
             target_state = None
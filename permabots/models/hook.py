@@ -8,7 +8,7 @@ import logging
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 import shortuuid
-from permabots import utils
+from permabots import snapshot
 
 logger = logging.getLogger(__name__)
 
@@ -49,12 +49,8 @@ class Hook(PermabotsModel):
         :param data: JSON data from hook POST
         :type: JSON
         """
-        env = {}
-        for env_var in bot.env_vars.all():
-            env.update(env_var.as_json())
-        context = {'env': env,
-                   'data': data,
-                   'emoji': utils.create_emoji_context()}
+        context = {'env': snapshot.get(bot).env,
+                   'data': data}
         response_text, response_keyboard = self.response.process(**context)
         return response_text, response_keyboard   
     
@@ -3,9 +3,9 @@ from django.db import models
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 import logging
-from jinja2 import Environment
 from permabots.models.base import PermabotsModel
 from permabots import validators
+from permabots import templating
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +20,7 @@ class Response(PermabotsModel):
     keyboard_template = models.TextField(null=True, blank=True, verbose_name=_("Keyboard template"),
                                          validators=[validators.validate_template, validators.validate_telegram_keyboard],
                                          help_text=_("Template to generate keyboard response. In jinja2 format. http://jinja.pocoo.org/"))
+    template_fields = ('text_template', 'keyboard_template')
     
     class Meta:
         verbose_name = _('Response')
@@ -35,13 +36,10 @@ class Response(PermabotsModel):
         :param context: Context generated while processing a conversation handler or a notification hook
         :returns: Text and keyboard response
         """
-        env = Environment(extensions=['jinja2_time.TimeExtension'])
-        response_text_template = env.from_string(self.text_template)
-        response_text = response_text_template.render(**context)
+        response_text = templating.render(self, self.text_template, context)
         logger.debug("Response %s generates text  %s" % (self.text_template, response_text))
         if self.keyboard_template:
-            response_keyboard_template = env.from_string(self.keyboard_template)
-            response_keyboard = response_keyboard_template.render(**context)
+            response_keyboard = templating.render(self, self.keyboard_template, context)
         else:
             response_keyboard = None
         logger.debug("Response %s generates keyboard  %s" % (self.keyboard_template, response_keyboard))
@@ -1,14 +1,29 @@
 # -*- coding: utf-8 -*-
-from django.db import models
+from django.db import models, transaction
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 import logging
 from permabots.models.base import PermabotsModel
+from permabots.models.fields import JSONField
 from permabots.models import TelegramChat, KikChat, KikUser, TelegramUser
+import copy
 import json
+import time
+import calendar
+import six
+from permabots import caching
+from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+
+def context_deltas():
+    """
+    Context of each state is stored in its own :class:`StateContext <permabots.models.state.StateContext>` row
+    so a state change only writes the context of that state.
+    """
+    return getattr(settings, 'PERMABOTS_CONTEXT_DELTAS', False)
+
 @python_2_unicode_compatible    
 class State(PermabotsModel):    
     """
@@ -29,66 +44,320 @@ class State(PermabotsModel):
         return "%s" % self.name
     
 
-class AbsChatState(PermabotsModel):
+@python_2_unicode_compatible    
+class ChatState(PermabotsModel):
     """
-    Abstract Model representing the state of a chat. Context used in previous states is associated.
+    State of a chat with a bot in any service. Context used in previous states is associated.
+    
+    Chats and users are identified by their key in the service so every service shares one table and
+    a chat state is found with one index lookup.
     """
-    context = models.TextField(verbose_name=_("Context"),
-                               help_text=_("Context serialized to json when this state was set"), null=True, 
-                               blank=True)
-    state = models.ForeignKey(State, verbose_name=_('State'), related_name='%(class)s_chat',
+    TELEGRAM, KIK, MESSENGER = 'telegram', 'kik', 'messenger'
+    SERVICE_CHOICES = (
+        (TELEGRAM, _('Telegram')),
+        (KIK, _('Kik')),
+        (MESSENGER, _('Messenger')),
+    )
+    bot = models.ForeignKey('Bot', verbose_name=_('Bot'), related_name='chat_states',
+                            help_text=_("Bot which chat state is attached to"), on_delete=models.CASCADE)
+    service = models.CharField(_('Service'), max_length=32, choices=SERVICE_CHOICES, help_text=_("Service of the chat"))
+    chat_key = models.CharField(_('Chat key'), max_length=255, help_text=_("Chat identifier in the service"))
+    user_key = models.CharField(_('User key'), max_length=255, blank=True, default='',
+                                help_text=_("User identifier in the service. Empty if chat only identifies the user"))
+    context = JSONField(verbose_name=_("Context"),
+                        help_text=_("Context serialized to json when this state was set"), null=True, 
+                        blank=True)
+    context_timestamps = JSONField(verbose_name=_("Context timestamps"), null=True, blank=True,
+                                   help_text=_("Unix time when context of each state was set"))
+    state = models.ForeignKey(State, verbose_name=_('State'), related_name='chat_states',
                               help_text=_("State related to the chat"), on_delete=models.CASCADE)
+    
+    #  Set by service proxies
+    SERVICE = None
 
     class Meta:
-        abstract = True
+        verbose_name = _('Chat State')
+        verbose_name_plural = _('Chats States')
+        unique_together = ('bot', 'service', 'chat_key', 'user_key')
+        
+    def __str__(self):
+        return "(%s:%s)" % (self.chat_key, self.state.name)
+    
+    def save(self, *args, **kwargs):
+        if not self.service:
+            self.service = self.SERVICE
+        if self.bot_id is None:
+            self.bot_id = self.state.bot_id
+        if kwargs.get('update_fields') is None and self._context_replaced():
+            #  Whole context assigned. Rows of previous contexts would override it
+            with transaction.atomic():
+                StateContext.objects.filter(chat_state_id=self.pk).delete()
+                super(ChatState, self).save(*args, **kwargs)
+            self._ctx = None
+        else:
+            super(ChatState, self).save(*args, **kwargs)
+        self.saved_context = copy.deepcopy(self.context)
+        
+    #  Context merged with StateContext rows and states with context changed not saved yet
+    _ctx = None
+    _changed_states = None
+    #  Inline context when it was loaded or saved
+    saved_context = None
+    
+    def _context_replaced(self):
+        if not context_deltas() or self._state.adding:
+            return False
+        return (self._get_inline_context() or {}) != (self.saved_context or {})
         
+    def _get_inline_context(self):
+        if isinstance(self.context, six.string_types):
+            #  Assigned already serialized
+            self.context = json.loads(self.context) if self.context else None
+        if self.context is None:
+            self.context = {}
+        return self.context
+    
     def _get_context(self):
-        if self.context:
-            return json.loads(self.context)
-        return {}
+        if not context_deltas():
+            return self._get_inline_context()
+        if self._ctx is None:
+            self._ctx = dict(self._get_inline_context())
+            if not self._state.adding:
+                self._ctx.update(StateContext.objects.filter(chat_state_id=self.pk).values_list('state_name', 'context'))
+        return self._ctx
     
     def _set_context(self, value):
-        self.context = json.dumps(value)        
+        self.context = value
+        self._ctx = None
     
     ctx = property(_get_context, _set_context)
+    
+    def _context_changed(self, state_name):
+        if self._changed_states is None:
+            self._changed_states = set()
+        self._changed_states.add(state_name)
+    
+    def set_state_context(self, state_name, context):
+        """
+        Keep context used in a state.
+        
+        :returns: True if context changed and must be saved
+        """
+        ctx = self.ctx
+        if state_name in ctx and ctx[state_name] == context:
+            return False
+        ctx[state_name] = context
+        self._context_changed(state_name)
+        self.context_timestamps = self.context_timestamps or {}
+        self.context_timestamps[state_name] = time.time()
+        return True
+    
+    def prune_context(self, max_states=None, max_bytes=None, timeout=None, now=None):
+        """
+        Remove contexts of oldest states to keep it bounded. Context of last state is not removed by max_bytes.
+        
+        :param max_states: Number of states contexts kept. None for no limit
+        :param max_bytes: Max size of context serialized to json. None for no limit
+        :param timeout: Seconds each state context is kept. None for no limit
+        :returns: True if some context was removed and must be saved
+        """
+        if max_states is None and max_bytes is None and timeout is None:
+            return False
+        now = now or time.time()
+        ctx = self.ctx
+        timestamps = self.context_timestamps or {}
+        #  Contexts set before timestamps were kept
+        default = calendar.timegm(self.updated_at.utctimetuple()) if self.updated_at else now
+        names = sorted(ctx, key=lambda name: timestamps.get(name, default))
+        removed = []
+        if timeout is not None:
+            removed.extend(name for name in names if now - timestamps.get(name, default) > timeout)
+            names = [name for name in names if name not in removed]
+        if max_states is not None and len(names) > max_states:
+            removed.extend(names[:len(names) - max_states])
+            names = names[len(names) - max_states:]
+        for name in removed:
+            del ctx[name]
+            timestamps.pop(name, None)
+        if max_bytes is not None:
+            while len(names) > 1 and len(json.dumps(ctx)) > max_bytes:
+                name = names.pop(0)
+                del ctx[name]
+                timestamps.pop(name, None)
+                removed.append(name)
+        for name in removed:
+            self._context_changed(name)
+        self.context_timestamps = timestamps
+        return bool(removed)
+    
+    def save_context_changes(self):
+        """
+        Write contexts changed by :func:`set_state_context` and :func:`prune_context`. With ``PERMABOTS_CONTEXT_DELTAS``
+        only rows of changed states are written. Contexts stored inline before are moved to rows when they change.
+        
+        :returns: Fields of the chat state that must be saved
+        """
+        changed, self._changed_states = self._changed_states, None
+        if not changed:
+            return []
+        if not context_deltas():
+            return ['context', 'context_timestamps']
+        fields = ['context_timestamps']
+        inline = self._get_inline_context()
+        if any(name in inline for name in changed):
+            for name in changed:
+                inline.pop(name, None)
+            fields.append('context')
+        removed = [name for name in changed if name not in self._ctx]
+        if removed:
+            StateContext.objects.filter(chat_state_id=self.pk, state_name__in=removed).delete()
+        for name in changed:
+            if name in self._ctx:
+                StateContext.objects.update_or_create(chat_state_id=self.pk, state_name=name,
+                                                      defaults={'context': self._ctx[name]})
+        return fields
+    
+    @classmethod
+    def cache_key(cls, bot_id, chat_id, user_id=None, service=None):
+        """
+        Cache key of the chat state of a chat and user with a bot.
+        """
+        key = '{}-{}-{}-{}'.format(service or cls.SERVICE, bot_id, chat_id, '' if user_id is None else user_id)
+        return caching.generate_key(ChatState, key, 'lookup')
+    
+    def get_cache_key(self):
+        return self.cache_key(self.bot_id, self.chat_key, self.user_key, self.service)
+    
+    #  Cache key when it was loaded or saved. Chat and user can be changed
+    saved_cache_key = None
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ChatState, cls).from_db(db, field_names, values)
+        instance.saved_cache_key = instance.get_cache_key()
+        instance.saved_context = copy.deepcopy(instance.context)
+        return instance
+    
+    @classmethod
+    def cache_keys_of_state(cls, state):
+        """
+        Cache keys of chat states in a state.
+        """
+        return [cls.cache_key(bot_id, chat_key, user_key, service) for bot_id, chat_key, user_key, service
+                in ChatState.objects.filter(state=state).values_list('bot_id', 'chat_key', 'user_key', 'service')]
+    
+    
+class ServiceChatStateManager(models.Manager):
+    """
+    Chat states of the service of the proxy model.
+    """
+    def get_queryset(self):
+        return super(ServiceChatStateManager, self).get_queryset().filter(service=self.model.SERVICE)
+    
+    
+class ChatUserMixin(object):
+    """
+    Chat and user of chat states of services with their own models. They are obtained from their keys.
+    """
+    chat_model = None
+    user_model = None
+    
+    def _get_related(self, model, key, attr):
+        obj = self.__dict__.get(attr)
+        if obj is None or six.text_type(obj.pk) != key:
+            obj = model.objects.get(pk=key)
+            self.__dict__[attr] = obj
+        return obj
+    
+    def _get_chat(self):
+        return self._get_related(self.chat_model, self.chat_key, '_chat')
+    
+    def _set_chat(self, chat):
+        self.__dict__['_chat'] = chat
+        self.chat_key = six.text_type(chat.pk)
+        
+    chat = property(_get_chat, _set_chat)
+    
+    def _get_user(self):
+        return self._get_related(self.user_model, self.user_key, '_user')
+    
+    def _set_user(self, user):
+        self.__dict__['_user'] = user
+        self.user_key = six.text_type(user.pk)
+        
+    user = property(_get_user, _set_user)
+    
+    @classmethod
+    def delete_for(cls, instance):
+        """
+        Delete chat states of a deleted chat or user. Chat states only keep their keys so they are not deleted in cascade.
+        """
+        key = six.text_type(instance.pk)
+        if isinstance(instance, cls.chat_model):
+            cls.objects.filter(chat_key=key).delete()
+        else:
+            cls.objects.filter(user_key=key).delete()
+    
 
-
-@python_2_unicode_compatible    
-class TelegramChatState(AbsChatState):
-    chat = models.ForeignKey(TelegramChat, db_index=True, verbose_name=_('Chat'), related_name='telegram_chatstates',
-                             help_text=_("Chat in Telegram API format. https://core.telegram.org/bots/api#chat"), on_delete=models.CASCADE)
-    user = models.ForeignKey(TelegramUser, db_index=True, verbose_name=_("Telegram User"), related_name='telegram_chatstates',
-                             help_text=_("Telegram unique username"), on_delete=models.CASCADE)
+class TelegramChatState(ChatUserMixin, ChatState):
+    SERVICE = ChatState.TELEGRAM
+    chat_model = TelegramChat
+    user_model = TelegramUser
+    
+    objects = ServiceChatStateManager()
 
     class Meta:
+        proxy = True
         verbose_name = _('Telegram Chat State')
         verbose_name_plural = _('Telegram Chats States')
-        
-    def __str__(self):
-        return "(%s:%s)" % (str(self.chat.id), self.state.name)
     
     
-@python_2_unicode_compatible    
-class KikChatState(AbsChatState):
-    chat = models.ForeignKey(KikChat, db_index=True, verbose_name=_('Kik Chat'), related_name='kik_chatstates',
-                             help_text=_("Chat in Kik API format. https://dev.kik.com/#/docs/messaging#authentication"), on_delete=models.CASCADE)
-    user = models.ForeignKey(KikUser, db_index=True, verbose_name=_("Kik User"), related_name='kik_chatstates',
-                             help_text=_("Kik unique username"), on_delete=models.CASCADE)
+class KikChatState(ChatUserMixin, ChatState):
+    SERVICE = ChatState.KIK
+    chat_model = KikChat
+    user_model = KikUser
+    
+    objects = ServiceChatStateManager()
     
     class Meta:
+        proxy = True
         verbose_name = _('Kik Chat State')
         verbose_name_plural = _('Kik Chats States')
-       
-    def __str__(self):
-        return "(%s:%s)" % (str(self.chat.id), self.state.name)
     
-@python_2_unicode_compatible    
-class MessengerChatState(AbsChatState):
-    chat = models.CharField(_("Sender Id"), db_index=True, max_length=255)
+
+class MessengerChatState(ChatState):
+    """
+    Messenger chats are identified by the sender id.
+    """
+    SERVICE = ChatState.MESSENGER
+    
+    objects = ServiceChatStateManager()
     
     class Meta:
+        proxy = True
         verbose_name = _('Messenger Chat State')
         verbose_name_plural = _('Messenger Chats States')
         
-    def __str__(self):
-        return "(%s:%s)" % (str(self.chat), self.state.name)
+    def _get_chat(self):
+        return self.chat_key
+    
+    def _set_chat(self, chat):
+        self.chat_key = chat
+        
+    chat = property(_get_chat, _set_chat)
+
+
+class StateContext(PermabotsModel):
+    """
+    Context used in a state by a chat state. Only used with ``PERMABOTS_CONTEXT_DELTAS``.
+    """
+    chat_state = models.ForeignKey(ChatState, verbose_name=_('Chat State'), related_name='state_contexts',
+                                   help_text=_("Chat state the context belongs to"), on_delete=models.CASCADE)
+    state_name = models.CharField(_('State name'), max_length=255)
+    context = JSONField(verbose_name=_("Context"), null=True, blank=True,
+                        help_text=_("Context serialized to json when this state was set"))
+    
+    class Meta:
+        verbose_name = _('State Context')
+        verbose_name_plural = _('State Contexts')
+        unique_together = ('chat_state', 'state_name')
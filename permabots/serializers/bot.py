@@ -62,11 +62,12 @@ class BotSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Bot
-        fields = ('id', 'name', 'created_at', 'updated_at', 'telegram_bot', 'kik_bot', 'messenger_bot')
+        fields = ('id', 'name', 'created_at', 'updated_at', 'telegram_bot', 'kik_bot', 'messenger_bot',
+                  'context_max_states', 'context_max_bytes', 'context_timeout')
         read_only_fields = ('id', 'created_at', 'updated_at', 'telegram_bot', 'kik_bot', 'messenger_bot')
         
 class BotUpdateSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Bot
-        fields = ('name', )
\ No newline at end of file
+        fields = ('name', 'context_max_states', 'context_max_bytes', 'context_timeout')
\ No newline at end of file
@@ -16,10 +16,17 @@ class RequestSerializer(serializers.HyperlinkedModelSerializer):
     url_parameters = AbsParamSerializer(many=True, required=False, help_text=_("List of url parameters used to complete the request"))
     header_parameters = AbsParamSerializer(many=True, required=False, help_text=_("List of header parameters used to complete the request"))
     data = serializers.JSONField(required=False)
+    cache_stats = serializers.SerializerMethodField(help_text=_("Response cache hits, misses and stale hits"))
     
     class Meta:
         model = Request
-        fields = ('url_template', 'method', 'data', 'url_parameters', 'header_parameters')
+        fields = ('url_template', 'method', 'data', 'url_parameters', 'header_parameters', 'cache_timeout', 'cache_stale_timeout', 'cache_stats')
+        
+    def get_cache_stats(self, obj):
+        # Not saved yet when representing validated data
+        if isinstance(obj, Request):
+            return obj.cache_stats()
+        return None
         
 class RequestUpdateSerializer(RequestSerializer):
     url_template = serializers.CharField(required=False, max_length=255, validators=[validators.validate_template],
@@ -93,6 +100,8 @@ class HandlerSerializer(serializers.ModelSerializer):
             instance.request.url_template = validated_data['request'].get('url_template', instance.request.url_template)
             instance.request.method = validated_data['request'].get('method', instance.request.method)
             instance.request.data = validated_data['request'].get('data', instance.request.data)
+            instance.request.cache_timeout = validated_data['request'].get('cache_timeout', instance.request.cache_timeout)
+            instance.request.cache_stale_timeout = validated_data['request'].get('cache_stale_timeout', instance.request.cache_stale_timeout)
             instance.request.save()
         
             if 'url_parameters' in validated_data['request']:
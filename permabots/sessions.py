@@ -0,0 +1,197 @@
+import os
+import time
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.status import is_success
+from six.moves.urllib.parse import urlparse
+from six.moves.http_cookiejar import DefaultCookiePolicy
+
+logger = logging.getLogger(__name__)
+
+#  Sessions of this worker process indexed by scheme and host
+_sessions = {}
+#  Concurrency limits of this worker process indexed by kind and key
+_semaphores = {}
+_pid = None
+_lock = threading.Lock()
+
+
+class RejectCookiePolicy(DefaultCookiePolicy):
+    """
+    Cookies are not kept. Sessions are shared by every bot and chat requesting the same host.
+    """
+    def set_ok(self, cookie, request):
+        return False
+
+
+def get_timeout():
+    """
+    (connect, read) timeouts in seconds. None waits forever.
+    """
+    return (getattr(settings, 'PERMABOTS_HTTP_CONNECT_TIMEOUT', None),
+            getattr(settings, 'PERMABOTS_HTTP_READ_TIMEOUT', None))
+
+def create_session():
+    """
+    Session keeping alive connections to one host with configured pool size and retry policy.
+    """
+    pool_size = getattr(settings, 'PERMABOTS_HTTP_POOL_SIZE', 10)
+    max_retries = getattr(settings, 'PERMABOTS_HTTP_MAX_RETRIES', 0)
+    if max_retries:
+        max_retries = Retry(total=max_retries,
+                            backoff_factor=getattr(settings, 'PERMABOTS_HTTP_RETRY_BACKOFF', 0),
+                            status_forcelist=getattr(settings, 'PERMABOTS_HTTP_RETRY_STATUSES', ()))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=max_retries)
+    session = requests.Session()
+    session.cookies.set_policy(RejectCookiePolicy())
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def host_key(url):
+    parsed = urlparse(url)
+    return '{}://{}'.format(parsed.scheme, parsed.netloc)
+
+def _reset_after_fork():
+    global _pid
+    if _pid != os.getpid():
+        _sessions.clear()
+        _semaphores.clear()
+        _pid = os.getpid()
+
+def get_session(url):
+    """
+    Session for the host of the url. Sessions are not shared with forked processes.
+    """
+    key = host_key(url)
+    with _lock:
+        _reset_after_fork()
+        session = _sessions.get(key)
+        if session is None:
+            logger.debug("Creating HTTP session for %s" % key)
+            session = create_session()
+            _sessions[key] = session
+    return session
+
+def get_semaphore(kind, key, size):
+    with _lock:
+        _reset_after_fork()
+        semaphore = _semaphores.get((kind, key, size))
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(size)
+            _semaphores[(kind, key, size)] = semaphore
+    return semaphore
+
+@contextmanager
+def concurrency_limit(kind, key, size):
+    """
+    Limit concurrent requests sharing the same key. No limit if size is None.
+    """
+    if size is None or key is None:
+        yield
+    else:
+        semaphore = get_semaphore(kind, key, size)
+        semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+def request(method, url, bot_id=None, **kwargs):
+    """
+    Perform a request using the pooled session of the url host.
+
+    In-flight requests are limited per host and per bot in each worker process with PERMABOTS_HTTP_MAX_PER_HOST
+    and PERMABOTS_HTTP_MAX_PER_BOT. Useful when workers run with a green pool (gevent or eventlet).
+
+    :param method: HTTP method. i.e. GET
+    :param url: URL to request
+    :param bot_id: Bot performing the request
+    :returns: Requests response `<http://docs.python-requests.org/en/master/api/#requests.Response>` _.
+    """
+    kwargs.setdefault('timeout', get_timeout())
+    with concurrency_limit('bot', bot_id, getattr(settings, 'PERMABOTS_HTTP_MAX_PER_BOT', None)):
+        with concurrency_limit('host', host_key(url), getattr(settings, 'PERMABOTS_HTTP_MAX_PER_HOST', None)):
+            return get_session(url).request(method, url, **kwargs)
+
+def response_cache_key(request, url, params, headers):
+    """
+    Cache key of a response for a request with url, params and headers already rendered.
+    """
+    rendered = json.dumps([url, sorted(params.items()), sorted(headers.items())])
+    digest = hashlib.sha1(rendered.encode('utf-8')).hexdigest()
+    return '{}.{}.response_{}-{}'.format(request._meta.app_label, request._meta.model_name, digest, request.pk)
+
+def stats_key(request, counter):
+    return '{}.{}.cache_{}-{}'.format(request._meta.app_label, request._meta.model_name, counter, request.pk)
+
+def _count(request, counter):
+    key = stats_key(request, counter)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        #  Evicted between add and incr
+        cache.set(key, 1, None)
+
+def get_cache_stats(request):
+    """
+    Hits, misses and stale hits of response cache for the request.
+    """
+    counters = ('hits', 'misses', 'stale')
+    values = cache.get_many([stats_key(request, counter) for counter in counters])
+    return dict((counter, values.get(stats_key(request, counter), 0)) for counter in counters)
+
+def fetch_and_cache(key, url, timeout, stale_timeout, bot_id=None, **kwargs):
+    """
+    Perform a GET request and cache its response if successful.
+
+    Cached entries are fresh during timeout seconds and can be served stale for stale_timeout seconds more.
+    """
+    response = request('GET', url, bot_id=bot_id, **kwargs)
+    if is_success(response.status_code):
+        cache.set(key, (time.time() + timeout, response), timeout + stale_timeout)
+    return response
+
+def revalidate(key, url, timeout, stale_timeout, bot_id=None, **kwargs):
+    """
+    Refresh a stale cached response allowing a new revalidation afterwards.
+    """
+    try:
+        return fetch_and_cache(key, url, timeout, stale_timeout, bot_id=bot_id, **kwargs)
+    finally:
+        cache.delete(key + '.revalidating')
+
+def cached_request(request, url, bot_id=None, **kwargs):
+    """
+    GET request served from the response cache if possible.
+
+    Fresh responses are returned without calling the backend. Stale responses are returned while a task refreshes them.
+
+    :param request: Request with cache_timeout set
+    :type Request: :class:`Request <permabots.models.handler.Request>`
+    :param url: URL to request
+    :param bot_id: Bot performing the request
+    """
+    key = response_cache_key(request, url, kwargs.get('params', {}), kwargs.get('headers', {}))
+    entry = cache.get(key)
+    if entry is not None:
+        fresh_until, response = entry
+        if time.time() < fresh_until:
+            _count(request, 'hits')
+            return response
+        _count(request, 'stale')
+        if cache.add(key + '.revalidating', True, request.cache_stale_timeout):
+            from permabots.tasks import refresh_cached_response
+            refresh_cached_response.delay(key, url, request.cache_timeout, request.cache_stale_timeout, bot_id, **kwargs)
+        return response
+    _count(request, 'misses')
+    return fetch_and_cache(key, url, request.cache_timeout, request.cache_stale_timeout, bot_id=bot_id, **kwargs)
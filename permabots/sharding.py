@@ -0,0 +1,49 @@
+from django.conf import settings
+import zlib
+
+
+def shards():
+    """
+    Number of queues messages are distributed to. Disabled with 0.
+    """
+    return getattr(settings, 'PERMABOTS_CHAT_SHARDS', 0)
+
+def get_queue(key):
+    """
+    Queue for the key. Same key is always sent to the same queue.
+
+    :returns: Queue name i.e. permabots.shard.3 or None if sharding is disabled
+    """
+    count = shards()
+    if not count:
+        return None
+    #  crc32 is stable between processes unlike hash()
+    shard = (zlib.crc32(key.encode('utf-8')) & 0xffffffff) % count
+    return '{}.{}'.format(getattr(settings, 'PERMABOTS_CHAT_SHARD_QUEUE', 'permabots.shard'), shard)
+
+def bot_queue(integration_bot):
+    """
+    Queue for tasks processing messages from any chat of the bot.
+    """
+    return get_queue('{}:{}'.format(integration_bot.identity, integration_bot.pk))
+
+def chat_queue(integration_bot, message):
+    """
+    Queue for tasks processing messages from the chat of the message.
+    """
+    try:
+        chat_id = integration_bot.get_chat_id(message)
+    except AttributeError:
+        #  i.e. Telegram callback queries without message
+        return bot_queue(integration_bot)
+    return get_queue('{}:{}:{}'.format(integration_bot.identity, integration_bot.pk, chat_id))
+
+def apply_async(task, args, queue, **options):
+    """
+    Send task to queue. Default queue if None.
+    """
+    if queue:
+        options['queue'] = queue
+    if not options:
+        return task.delay(*args)
+    return task.apply_async(args, **options)
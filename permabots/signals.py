@@ -1,9 +1,12 @@
 from django.urls import reverse
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
 import logging
 from permabots.validators import validate_token
 from django.apps import apps
 from permabots import caching
+from permabots import routing
+from permabots import templating
 
 logger = logging.getLogger(__name__)
 
@@ -55,13 +58,65 @@ def delete_cache(sender, instance, **kwargs):
     caching.delete(sender, instance)
     
 def delete_cache_env_vars(sender, instance, **kwargs):
-    caching.delete(instance.bot._meta.model, instance.bot, 'env_vars')
+    caching.bump_config_version(instance.bot)
     
 def delete_cache_handlers(sender, instance, **kwargs):
-    caching.delete(instance.bot._meta.model, instance.bot, 'handlers')
+    routing.invalidate(instance.bot)
     
 def delete_cache_source_states(sender, instance, **kwargs):
-    caching.delete(instance._meta.model, instance, 'source_states')
+    routing.invalidate(instance.bot)
+    
+def delete_cache_hook(sender, instance, **kwargs):
+    caching.cache.delete(caching.generate_key(sender, instance.key, 'key'))
+    
+def bump_config_version(sender, instance, **kwargs):
+    caching.bump_config_version(instance.bot)
+    
+def bump_config_version_handler(sender, instance, **kwargs):
+    #  Requests and responses are cached with their handler
+    try:
+        caching.bump_config_version(instance.handler.bot)
+    except ObjectDoesNotExist:
+        pass
+    
+def bump_config_version_param(sender, instance, **kwargs):
+    try:
+        caching.bump_config_version(instance.request.handler.bot)
+    except ObjectDoesNotExist:
+        pass
+    
+def set_cache_chat_state(sender, instance, **kwargs):
+    key = instance.get_cache_key()
+    if instance.saved_cache_key and instance.saved_cache_key != key:
+        #  Chat or user changed
+        caching.cache.delete(instance.saved_cache_key)
+    instance.saved_cache_key = key
+    caching.cache.set(key, instance)
+    
+def delete_cache_chat_state(sender, instance, **kwargs):
+    caching.cache.delete_many([key for key in (instance.get_cache_key(), instance.saved_cache_key) if key])
+    
+def delete_cache_state_chat_states(sender, instance, **kwargs):
+    caching.cache.delete_many(apps.get_model('permabots', 'ChatState').cache_keys_of_state(instance))
+    
+def delete_chat_states(sender, instance, **kwargs):
+    for model_name in ('TelegramChatState', 'KikChatState'):
+        model = apps.get_model('permabots', model_name)
+        if sender in (model.chat_model, model.user_model):
+            model.delete_for(instance)
+    
+def delete_cache_templates(sender, instance, **kwargs):
+    templating.invalidate(instance)
+    
+def compile_templates(sender, instance, **kwargs):
+    templating.invalidate(instance)
+    for field in instance.template_fields:
+        source = getattr(instance, field)
+        if source:
+            try:
+                templating.get_template(instance, source)
+            except:
+                logger.error("Failure: Template %s for %s not compiled" % (field, str(instance)))
     
 def delete_bot_integrations(sender, instance, **kwargs):
     if instance.telegram_bot:
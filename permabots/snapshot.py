@@ -0,0 +1,106 @@
+from django.apps import apps
+from django.core.cache import cache
+from collections import namedtuple
+from permabots import caching, metrics
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+#  Changed when the layout of dumped snapshots changes
+FORMAT = 1
+
+
+class BotSnapshot(namedtuple('BotSnapshot', ['version', 'handlers', 'source_states', 'env'])):
+    """
+    Configuration of a bot needed to process messages, read with one cache fetch.
+
+    * version: configuration version of the bot the snapshot was built with
+    * handlers: enabled handlers in priority order with their response, request, parameters and target state
+    * source_states: frozenset of source state ids by handler id
+    * env: environment variables dict
+    """
+    __slots__ = ()
+
+
+def _model(name):
+    return apps.get_model('permabots', name)
+
+def _values(instance):
+    if instance is None:
+        return None
+    return tuple(getattr(instance, field.attname) for field in instance._meta.concrete_fields)
+
+def dump(bot, version):
+    """
+    Configuration of the bot as plain tuples. Model instances are not pickled.
+    """
+    models = [_model(name) for name in ('Handler', 'Response', 'Request', 'UrlParam', 'HeaderParam', 'State')]
+    fields = dict((model._meta.model_name, [field.attname for field in model._meta.concrete_fields]) for model in models)
+    handlers = []
+    query = bot.handlers.filter(enabled=True).select_related('response', 'request', 'target_state')
+    for handler in query.prefetch_related('source_states', 'request__url_parameters', 'request__header_parameters'):
+        request = handler.request
+        handlers.append((_values(handler),
+                         _values(handler.response),
+                         _values(request),
+                         tuple(_values(param) for param in request.url_parameters.all()) if request else (),
+                         tuple(_values(param) for param in request.header_parameters.all()) if request else (),
+                         _values(handler.target_state),
+                         tuple(state.pk for state in handler.source_states.all())))
+    env = []
+    for env_var in bot.env_vars.all():
+        env.extend(env_var.as_json().items())
+    return (FORMAT, version, fields, tuple(handlers), tuple(env))
+
+def load(data):
+    """
+    Build the snapshot from dumped data. Nothing is read from DB.
+    """
+    _, version, fields, handlers_data, env = data
+
+    def build(name, values):
+        if values is None:
+            return None
+        model = _model(name)
+        return model.from_db(None, fields[model._meta.model_name], values)
+    handlers = []
+    source_states = {}
+    for handler_values, response, request, url_params, header_params, target_state, state_ids in handlers_data:
+        handler = build('Handler', handler_values)
+        handler.response = build('Response', response)
+        handler.request = build('Request', request)
+        if handler.request:
+            handler.request.snapshot_params = {'url_parameters': [build('UrlParam', values) for values in url_params],
+                                               'header_parameters': [build('HeaderParam', values) for values in header_params]}
+        handler.target_state = build('State', target_state)
+        handlers.append(handler)
+        source_states[handler.pk] = frozenset(state_ids)
+    return BotSnapshot(version, tuple(handlers), source_states, dict(env))
+
+def get(bot):
+    """
+    Snapshot of the current configuration of the bot. Its configuration version and the snapshot are fetched together
+    and the snapshot is rebuilt if it was built with other version.
+    """
+    key = caching.generate_key(bot._meta.model, bot.pk, 'snapshot')
+    bot_snapshot = caching.local_get(key)
+    if bot_snapshot is not None:
+        metrics.hit('snapshot', local=True)
+        return bot_snapshot
+    local = caching.local_version()
+    version_key = caching.config_version_key(bot.pk)
+    values = cache.get_many([version_key, key])
+    version = values.get(version_key) or caching.config_version(bot)
+    data = values.get(key)
+    if data is None or data[0] != FORMAT or data[1] != version:
+        logger.debug("Building snapshot of bot %s with version %s" % (bot, version))
+        started = time.time()
+        data = dump(bot, version)
+        cache.set(key, data)
+        metrics.miss('snapshot', started, data)
+    else:
+        metrics.hit('snapshot')
+    bot_snapshot = load(data)
+    caching.local_set(key, bot_snapshot, local)
+    return bot_snapshot
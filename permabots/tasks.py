@@ -5,6 +5,10 @@ import logging
 import traceback
 import sys
 from permabots import caching
+from permabots import sessions
+from permabots import batching
+from permabots import sharding
+from permabots import ingestion
 
 logger = logging.getLogger(__name__)
 
@@ -74,7 +78,131 @@ def handle_messenger_message(message_id, bot_id):
             # Each update is only used once
             caching.delete(MessengerMessage, message)        
 
+def _handle_batch(integration_bot, ids, objs):
+    """
+    Process messages of a bot in the order of ids.
+    """
+    by_id = dict((str(obj.id), obj) for obj in objs)
+    for obj_id in ids:
+        obj = by_id.get(str(obj_id))
+        if obj is None:
+            logger.error("Message %s does not exists" % obj_id)
+            continue
+        try:
+            integration_bot.bot.handle_message(obj, integration_bot)
+        except:
+            exc_info = sys.exc_info()
+            traceback.print_exception(*exc_info)
+            logger.error("Error processing %s for bot %s" % (obj, integration_bot))
+        # Each update is only used once
+        caching.delete(obj._meta.model, obj)
+
+@shared_task
+def handle_updates(update_ids, bot_id):
+    try:
+        telegram_bot = caching.get_or_set(TelegramBot, bot_id)
+    except TelegramBot.DoesNotExist:
+        logger.error("Bot  %s does not exists or disabled" % bot_id)
+    else:
+        updates = TelegramUpdate.objects.filter(id__in=update_ids)
+        updates = updates.select_related('message__from_user', 'message__chat', 'callback_query__from_user',
+                                         'callback_query__message__from_user', 'callback_query__message__chat')
+        _handle_batch(telegram_bot, update_ids, updates)
+
+@shared_task
+def handle_messages(message_ids, bot_id):
+    try:
+        kik_bot = caching.get_or_set(KikBot, bot_id)
+    except KikBot.DoesNotExist:
+        logger.error("Bot  %s does not exists or disabled" % bot_id)
+    else:
+        messages = KikMessage.objects.filter(id__in=message_ids).select_related('from_user', 'chat')
+        _handle_batch(kik_bot, message_ids, messages)
+
+@shared_task
+def handle_messenger_messages(message_ids, bot_id):
+    try:
+        messenger_bot = caching.get_or_set(MessengerBot, bot_id)
+    except MessengerBot.DoesNotExist:
+        logger.error("Bot  %s does not exists or disabled" % bot_id)
+    else:
+        messages = MessengerMessage.objects.filter(id__in=message_ids)
+        _handle_batch(messenger_bot, message_ids, messages)
+
+@shared_task
+def flush_updates(bot_id):
+    """
+    Process together all Telegram updates buffered for the bot.
+    """
+    update_ids = batching.pop_all('telegram', bot_id)
+    # Other worker is flushing or some updates are not buffered yet. Try again later
+    if update_ids is None or batching.reschedule('telegram', bot_id):
+        try:
+            queue = sharding.bot_queue(caching.get_or_set(TelegramBot, bot_id))
+        except TelegramBot.DoesNotExist:
+            logger.error("Bot  %s does not exists or disabled" % bot_id)
+        else:
+            sharding.apply_async(flush_updates, (bot_id,), queue, countdown=batching.window())
+    if update_ids:
+        handle_updates(update_ids, bot_id)
             
+@shared_task
+def handle_update_data(data, bot_id):
+    """
+    Process a Telegram update received by the webhook without storing it. Update is stored later in bulk.
+    """
+    try:
+        telegram_bot = caching.get_or_set(TelegramBot, bot_id)
+    except TelegramBot.DoesNotExist:
+        logger.error("Bot  %s does not exists or disabled" % bot_id)
+        return
+    update = ingestion.build_update(data, telegram_bot)
+    try:
+        telegram_bot.bot.handle_message(update, telegram_bot)
+    except:
+        exc_info = sys.exc_info()
+        traceback.print_exception(*exc_info)
+        logger.error("Error processing %s for bot %s" % (update, telegram_bot))
+    flush_later, flush_now = ingestion.buffer_update(bot_id, data)
+    if flush_now:
+        persist_updates.delay()
+    elif flush_later:
+        persist_updates.apply_async(countdown=ingestion.window())
+
+@shared_task
+def persist_updates():
+    """
+    Store together Telegram updates already processed from webhook data of any bot.
+    """
+    items = batching.pop_all(ingestion.BUFFER, ingestion.BUFFER_KEY)
+    # Other worker is storing or some updates are not buffered yet. Try again later
+    if items is None or batching.reschedule(ingestion.BUFFER, ingestion.BUFFER_KEY):
+        persist_updates.apply_async(countdown=ingestion.window())
+    if items:
+        updates, buffered = [], []
+        for bot_id, data, retries in items:
+            try:
+                telegram_bot = caching.get_or_set(TelegramBot, bot_id)
+            except TelegramBot.DoesNotExist:
+                logger.error("Bot  %s does not exists. Update %s not stored" % (bot_id, data))
+            else:
+                updates.append(ingestion.build_update(data, telegram_bot))
+                buffered.append((bot_id, data, retries))
+        try:
+            ingestion.persist_updates(updates)
+        except Exception:
+            # Updates already answered are buffered again to be stored later
+            logger.error("Error storing %s updates. Buffered again" % len(updates))
+            flush_later = False
+            for bot_id, data, retries in buffered:
+                if retries < ingestion.max_retries():
+                    flush_later = ingestion.buffer_update(bot_id, data, retries + 1)[0] or flush_later
+                else:
+                    logger.error("Update %s of bot %s not stored after %s retries. Discarded" % (data.get('update_id'), bot_id, retries))
+            if flush_later:
+                persist_updates.apply_async(countdown=ingestion.window())
+            raise
+
 @shared_task
 def handle_hook(hook_id, data):
     try:
@@ -88,3 +216,13 @@ def handle_hook(hook_id, data):
             exc_info = sys.exc_info()
             traceback.print_exception(*exc_info)
             logger.error("Error processing %s for bot %s" % (hook, hook.bot))
+
+
+@shared_task
+def refresh_cached_response(key, url, timeout, stale_timeout, bot_id=None, **kwargs):
+    try:
+        sessions.revalidate(key, url, timeout, stale_timeout, bot_id=bot_id, **kwargs)
+    except:
+        exc_info = sys.exc_info()
+        traceback.print_exception(*exc_info)
+        logger.error("Error refreshing cached response for %s" % url)
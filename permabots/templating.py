@@ -0,0 +1,94 @@
+from jinja2 import Environment
+from jinja2.bccache import MemcachedBytecodeCache, FileSystemBytecodeCache
+from django.conf import settings
+from django.core.cache import cache
+from collections import OrderedDict
+import hashlib
+import threading
+from permabots import utils
+
+#  Environment shared by every template rendered by permabots
+env = Environment(extensions=['jinja2_time.TimeExtension'])
+#  Emojis are resolved as a global so they are only looked up by templates using them
+env.globals['emoji'] = utils.create_emoji_context()
+
+#  Compiled templates in least recently used order
+_templates = OrderedDict()
+_lock = threading.Lock()
+
+
+def source_digest(source):
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+def generate_key(instance, source):
+    return (instance._meta.app_label, instance._meta.model_name, str(instance.pk), source_digest(source))
+
+def template_name(instance, source):
+    """
+    Name of the template in bytecode cache. Each template of the instance has its own bucket.
+    """
+    return '{}.{}-{}.{}'.format(instance._meta.app_label, instance._meta.model_name, instance.pk, source_digest(source))
+
+def get_bytecode_cache():
+    """
+    Persistent bytecode cache configured with PERMABOTS_TEMPLATE_BYTECODE_CACHE.
+
+    * 'cache': Django cache backend (default)
+    * 'filesystem': PERMABOTS_TEMPLATE_BYTECODE_DIR or system temporary directory
+    * None: disabled
+    """
+    backend = getattr(settings, 'PERMABOTS_TEMPLATE_BYTECODE_CACHE', 'cache')
+    if backend == 'cache':
+        return MemcachedBytecodeCache(cache, prefix='permabots.template.bytecode-',
+                                      timeout=getattr(settings, 'PERMABOTS_TEMPLATE_BYTECODE_TIMEOUT', 86400))
+    elif backend == 'filesystem':
+        return FileSystemBytecodeCache(getattr(settings, 'PERMABOTS_TEMPLATE_BYTECODE_DIR', None))
+    return None
+
+def compile_template(instance, source):
+    """
+    Compile source reusing bytecode from the persistent bytecode cache if some process already compiled it.
+    """
+    bytecode_cache = get_bytecode_cache()
+    if bytecode_cache is None:
+        return env.from_string(source)
+    name = template_name(instance, source)
+    bucket = bytecode_cache.get_bucket(env, name, None, source)
+    code = bucket.code
+    if code is None:
+        code = env.compile(source, name)
+        bucket.code = code
+        bytecode_cache.set_bucket(bucket)
+    return env.template_class.from_code(env, code, env.make_globals(None))
+
+def get_template(instance, source):
+    """
+    Compiled template for source of the instance. Only compiled if not found in cache.
+
+    :param instance: Model instance the template belongs to
+    :param source: Template text
+    """
+    key = generate_key(instance, source)
+    with _lock:
+        template = _templates.pop(key, None)
+        if template is not None:
+            _templates[key] = template
+            return template
+    template = compile_template(instance, source)
+    with _lock:
+        _templates[key] = template
+        while len(_templates) > getattr(settings, 'PERMABOTS_TEMPLATE_CACHE_SIZE', 1000):
+            _templates.popitem(last=False)
+    return template
+
+def render(instance, source, context):
+    return get_template(instance, source).render(**context)
+
+def invalidate(instance):
+    """
+    Remove every compiled template of the instance.
+    """
+    prefix = (instance._meta.app_label, instance._meta.model_name, str(instance.pk))
+    with _lock:
+        for key in [key for key in _templates if key[:3] == prefix]:
+            del _templates[key]
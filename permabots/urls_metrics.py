@@ -0,0 +1,5 @@
+from django.conf.urls import url
+from permabots import views
+
+urlpatterns = [
+    url(r'^metrics/$', views.PrometheusMetricsView.as_view(), name='metrics')]
@@ -1,12 +1,41 @@
 from telegram import emoji
 from six import iteritems, PY2
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping  # noqa
+
+
+class EmojiContext(Mapping):
+    """
+    Read only dict of emojis. Built on first access and shared by the whole process.
+    """
+    def __init__(self):
+        self._emojis = None
+
+    def _get_emojis(self):
+        if self._emojis is None:
+            emojis = {}
+            for key, value in iteritems(emoji.Emoji.__dict__):
+                if '__' not in key:
+                    if PY2:
+                        value = value.decode('utf-8')
+                    emojis[key.lower().replace(" ", "_")] = value
+            self._emojis = emojis
+        return self._emojis
+
+    def __getitem__(self, key):
+        return self._get_emojis()[key]
+
+    def __iter__(self):
+        return iter(self._get_emojis())
+
+    def __len__(self):
+        return len(self._get_emojis())
+
+
+_emoji_context = EmojiContext()
 
 
 def create_emoji_context():
-    context = {}
-    for key, value in iteritems(emoji.Emoji.__dict__):
-        if '__' not in key:
-            if PY2:
-                value = value.decode('utf-8')
-            context[key.lower().replace(" ", "_")] = value                    
-    return context
\ No newline at end of file
+    return _emoji_context
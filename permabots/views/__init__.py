@@ -1,2 +1,3 @@
 from permabots.views.hooks import *  # NOQA
-from permabots.views.api import *  # NOQA
\ No newline at end of file
+from permabots.views.api import *  # NOQA
+from permabots.views.metrics import PrometheusMetricsView  # NOQA
@@ -40,7 +40,10 @@ class BotList(PermabotsAPIView):
         serializer = BotSerializer(data=request.data)
         if serializer.is_valid():
             bot = Bot.objects.create(owner=request.user,
-                                     name=serializer.data['name'])
+                                     name=serializer.validated_data['name'],
+                                     context_max_states=serializer.validated_data.get('context_max_states'),
+                                     context_max_bytes=serializer.validated_data.get('context_max_bytes'),
+                                     context_timeout=serializer.validated_data.get('context_timeout'))
             return Response(BotSerializer(bot).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -113,7 +113,7 @@ class BaseChatStateList(ListBotAPIView):
             raise Http404         
     
     def _query(self, bot):
-        return self.model.objects.filter(state__bot=bot)
+        return self.model.objects.filter(bot=bot)
 
     def _creator(self, bot, serializer):
         state = self.get_state(bot, serializer.data['state'])
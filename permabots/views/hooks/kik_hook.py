@@ -3,66 +3,117 @@ from permabots.serializers import KikMessageSerializer
 from permabots.models import KikBot, KikUser, KikChat, KikMessage
 from rest_framework.response import Response
 from rest_framework import status
+from django.db import transaction, IntegrityError
 import logging
-from permabots.tasks import handle_message
+from permabots.tasks import handle_message, handle_messages
+from permabots import sharding
+from collections import OrderedDict
 from datetime import datetime
 from permabots import caching
+from permabots import dedup
 import sys
 import traceback
 
 logger = logging.getLogger(__name__)
 
-class OnlyTextMessages(Exception):
-    pass
-
 
 class KikHookView(APIView):
     """
     View for Kik webhook.
     """
     
-    def create_user(self, username):
+    def _create_missing(self, model, existing, missing):
+        """
+        Create missing instances with one insert. If other process creates some meanwhile create them one by one.
+        """
         try:
-            user = caching.get_or_set(KikUser, username)
-        except KikUser.DoesNotExist:
-            user, _ = KikUser.objects.get_or_create(username=username)
-        return user
+            with transaction.atomic():
+                model.objects.bulk_create(missing)
+        except IntegrityError:
+            for instance in missing:
+                model.objects.get_or_create(pk=instance.pk)
+        existing.update((instance.pk, instance) for instance in missing)
     
-    def create_message(self, serializer, bot):
-        sender = self.create_user(serializer.data['from'])
+    def resolve_users(self, messages_data):
+        usernames = set()
+        for data in messages_data:
+            usernames.add(data['from'])
+            usernames.update(data.get('participants') or [])
+        users = KikUser.objects.in_bulk(list(usernames))
+        self._create_missing(KikUser, users, [KikUser(username=username) for username in usernames if username not in users])
+        return users
+    
+    def resolve_chats(self, messages_data, users):
+        chats_data = OrderedDict((data['chatId'], data) for data in messages_data)
+        chats = KikChat.objects.in_bulk(list(chats_data.keys()))
+        missing = [KikChat(id=chat_id) for chat_id in chats_data if chat_id not in chats]
+        self._create_missing(KikChat, chats, missing)
+        Participant = KikChat.participants.through
+        participants = [Participant(kikchat_id=chat.id, kikuser_id=users[username].pk)
+                        for chat in missing for username in chats_data[chat.id].get('participants') or []]
         try:
-            chat = caching.get_or_set(KikChat, serializer.data['chatId'])
-        except KikChat.DoesNotExist:
-            chat, _ = KikChat.objects.get_or_create(id=serializer.data['chatId'])
-            if 'participants' in serializer.data:
-                for participant in serializer.data['participants']:
-                    chat.participants.add(self.create_user(participant))                    
-        if serializer.data['type'] == 'start-chatting':
-            body = "/start"
-        elif serializer.data['type'] == 'scan-data':
-            body = "/start"
-        else:
-            body = serializer.data['body']
-        message, _ = KikMessage.objects.get_or_create(message_id=serializer.data['id'],
-                                                      from_user=sender,
-                                                      timestamp=datetime.fromtimestamp(serializer.data['timestamp']),
-                                                      chat=chat,
-                                                      body=body)
-        
-        caching.set(message)
-        return message
+            with transaction.atomic():
+                Participant.objects.bulk_create(participants)
+        except IntegrityError:
+            for participant in participants:
+                Participant.objects.get_or_create(kikchat_id=participant.kikchat_id, kikuser_id=participant.kikuser_id)
+        return chats
+    
+    def body(self, data):
+        if data['type'] == 'start-chatting':
+            return "/start"
+        elif data['type'] == 'scan-data':
+            return "/start"
+        return data['body']
+    
+    def create_messages(self, messages_data):
+        """
+        Create messages resolving all users and chats with a few queries.
+        """
+        users = self.resolve_users(messages_data)
+        chats = self.resolve_chats(messages_data, users)
+        messages = [KikMessage(message_id=data['id'],
+                               from_user=users[data['from']],
+                               timestamp=datetime.fromtimestamp(data['timestamp']),
+                               chat=chats[data['chatId']],
+                               body=self.body(data)) for data in messages_data]
+        KikMessage.objects.bulk_create(messages)
+        caching.set_many(messages)
+        return messages
+    
+    def accepted_types(self, data):
+        return data['type'] == 'start-chatting' or data['type'] == 'text' or data['type'] == 'scan-data'
     
-    def accepted_types(self, serializer):
-        return serializer.data['type'] == 'start-chatting' or serializer.data['type'] == 'text' or serializer.data['type'] == 'scan-data'
+    def delay_messages(self, messages, bot):
+        """
+        Delay processing to one task per chat. Messages of each chat are processed in order.
+        """
+        by_chat = OrderedDict()
+        for message in messages:
+            by_chat.setdefault(message.chat.id, []).append(message)
+        chats = list(by_chat.values())
+        for index, chat_messages in enumerate(chats):
+            queue = sharding.chat_queue(bot, chat_messages[0])
+            try:
+                if len(chat_messages) == 1:
+                    sharding.apply_async(handle_message, (chat_messages[0].id, bot.id), queue)
+                else:
+                    sharding.apply_async(handle_messages, ([message.id for message in chat_messages], bot.id), queue)
+            except:
+                # Messages not delayed are accepted again when Kik delivers them again
+                for not_delayed in chats[index:]:
+                    for message in not_delayed:
+                        dedup.forget(bot.identity, bot.id, str(message.message_id))
+                raise
     
     def post(self, request, hook_id):
         """
         Process Kik webhook:
             1. Get an enabled Kik bot
             2. Verify Kik signature
-            3. Serialize each message
-            4. For each message create :class:`KikMessage <permabots.models.kik_api.KikMessage>` and :class:`KikUser <permabots.models.kik_api.KikUser>`
-            5. Delay each message processing to a task      
+            3. Serialize all messages
+            4. Create all :class:`KikMessage <permabots.models.kik_api.KikMessage>` and :class:`KikUser <permabots.models.kik_api.KikUser>` together
+            5. Delay processing of messages to a task per chat
             6. Response provider
         """
         try:
@@ -77,29 +128,38 @@ class KikHookView(APIView):
             logger.debug("Kik Bot data %s not verified %s" % (request.data, signature))
             return Response(status=403)
         logger.debug("Kik Bot data %s verified" % (request.data))
-        for kik_message in request.data['messages']:
-            serializer = KikMessageSerializer(data=kik_message)   
-            logger.debug("Kik message %s serialized" % (kik_message))
-            if serializer.is_valid():            
+        serializer = KikMessageSerializer(data=request.data['messages'], many=True)
+        if not serializer.is_valid():
+            logger.error("Validation error: %s from kik messages %s" % (serializer.errors, request.data['messages']))
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        messages_data = []
+        for data in serializer.data:
+            if not self.accepted_types(data):
+                logger.warning("Not text message %s for bot %s" % (data, hook_id))
+            elif dedup.seen(bot.identity, bot.id, data['id']):
+                logger.warning("Message %s already received by bot %s" % (data['id'], hook_id))
+            else:
+                messages_data.append(data)
+        if messages_data:
+            try:
+                messages = self.create_messages(messages_data)
+            except:
+                exc_info = sys.exc_info()
+                traceback.print_exception(*exc_info)                
+                logger.error("Error processing %s for bot %s" % (messages_data, hook_id))
+                # Kik will deliver them again
+                for data in messages_data:
+                    dedup.forget(bot.identity, bot.id, data['id'])
+                return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            if bot.enabled:
+                logger.debug("Kik Bot %s attending %s messages" % (bot, len(messages)))
                 try:
-                    if not self.accepted_types(serializer):
-                        raise OnlyTextMessages
-                    message = self.create_message(serializer, bot)
-                    if bot.enabled:
-                        logger.debug("Kik Bot %s attending request %s" % (bot, kik_message))
-                        handle_message.delay(message.id, bot.id)
-                    else:
-                        logger.error("Message %s ignored by disabled bot %s" % (message, bot))
-                except OnlyTextMessages:
-                    logger.warning("Not text message %s for bot %s" % (kik_message, hook_id))
-                    return Response(status=status.HTTP_200_OK)
+                    self.delay_messages(messages, bot)
                 except:
                     exc_info = sys.exc_info()
-                    traceback.print_exception(*exc_info)                
-                    logger.error("Error processing %s for bot %s" % (kik_message, hook_id))
+                    traceback.print_exception(*exc_info)
+                    logger.error("Error delaying %s messages for bot %s" % (len(messages), hook_id))
                     return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                   
             else:
-                logger.error("Validation error: %s from kik message %s" % (serializer.errors, kik_message))
-                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+                logger.error("Messages %s ignored by disabled bot %s" % (messages, bot))
+        return Response(serializer.data, status=status.HTTP_200_OK)
@@ -2,10 +2,14 @@ from rest_framework.views import APIView
 from permabots.models import MessengerBot, MessengerMessage
 from rest_framework.response import Response
 from rest_framework import status
+from django.db import transaction
 import logging
-from permabots.tasks import handle_messenger_message
+from permabots.tasks import handle_messenger_message, handle_messenger_messages
+from permabots import sharding
+from collections import OrderedDict
 from datetime import datetime
 from permabots import caching
+from permabots import dedup
 import sys
 import traceback
 from time import mktime
@@ -195,7 +199,7 @@ class MessengerHookView(APIView):
             return Response(int(request.query_params.get('hub.challenge')))
         return Response('Error, wrong validation token')
     
-    def create_message(self, webhook_message, bot):
+    def build_message(self, webhook_message, bot):
         if webhook_message.is_message:
             type = MessengerMessage.MESSAGE
             text = webhook_message.message.text
@@ -205,25 +209,78 @@ class MessengerHookView(APIView):
             text = None
             postback = webhook_message.message.payload            
         
-        message, _ = MessengerMessage.objects.get_or_create(bot=bot,
-                                                            sender=webhook_message.sender,
-                                                            recipient=webhook_message.recipient,
-                                                            timestamp=webhook_message.timestamp,
-                                                            type=type,
-                                                            text=text,
-                                                            postback=postback)
-        
-        caching.set(message)
-        return message
+        return MessengerMessage(bot=bot,
+                                sender=webhook_message.sender,
+                                recipient=webhook_message.recipient,
+                                timestamp=webhook_message.timestamp,
+                                type=type,
+                                text=text,
+                                postback=postback)
+    
+    def message_key(self, webhook_message):
+        """
+        Identifier to detect redeliveries. Postbacks have no mid.
+        """
+        if webhook_message.is_message and webhook_message.message.mid:
+            return webhook_message.message.mid
+        return '%s.%s' % (webhook_message.sender, webhook_message.timestamp.isoformat())
+    
+    def create_messages(self, messages, hook_id):
+        """
+        Store messages with one insert. If it fails they are stored one by one discarding wrong ones.
+        """
+        try:
+            with transaction.atomic():
+                MessengerMessage.objects.bulk_create(messages)
+        except:
+            logger.error("Error storing %s messages for bot %s. Storing them one by one" % (len(messages), hook_id))
+            created = []
+            for message in messages:
+                try:
+                    with transaction.atomic():
+                        message.save()
+                except:
+                    exc_info = sys.exc_info()
+                    traceback.print_exception(*exc_info)
+                    logger.error("Error processing %s for bot %s" % (message, hook_id))
+                else:
+                    created.append(message)
+            messages = created
+        caching.set_many(messages)
+        return messages
+    
+    def delay_messages(self, messages, bot):
+        """
+        Delay processing to one task per sender. Messages of each sender are processed in order.
+        """
+        by_sender = OrderedDict()
+        for message in messages:
+            by_sender.setdefault(message.sender, []).append(message)
+        senders = list(by_sender.values())
+        for index, sender_messages in enumerate(senders):
+            queue = sharding.chat_queue(bot, sender_messages[0])
+            try:
+                if len(sender_messages) == 1:
+                    sharding.apply_async(handle_messenger_message, (sender_messages[0].id, bot.id), queue)
+                else:
+                    sharding.apply_async(handle_messenger_messages, ([message.id for message in sender_messages], bot.id), queue)
+            except:
+                # Messages not delayed are accepted again when Messenger delivers them again
+                for not_delayed in senders[index:]:
+                    for message in not_delayed:
+                        dedup.forget(bot.identity, bot.id, message.dedup_key)
+                raise
 
     def post(self, request, hook_id):
         """
         Process Messenger webhook.
             1. Get an enabled Messenger bot
             3. For each message serialize
-            4. For each message create :class:`MessengerMessage <permabots.models.messenger_api.MessengerMessage>`
-            5. Delay processing of each message to a task      
+            4. Create all :class:`MessengerMessage <permabots.models.messenger_api.MessengerMessage>` together
+            5. Delay processing of messages to a task per sender
             6. Response provider
+            
+        Messages with errors are discarded without failing the rest.
         """
         try:
             bot = caching.get_or_set(MessengerBot, hook_id)
@@ -232,22 +289,35 @@ class MessengerHookView(APIView):
             return Response(status=status.HTTP_404_NOT_FOUND)
         logger.debug("Messenger Bot %s attending request %s" % (bot, request.data))
         webhook = Webhook.from_json(request.data)
+        messages = []
         for webhook_entry in webhook.entries:
             for webhook_message in webhook_entry.messaging:
                 try:
                     if webhook_message.is_delivery:
                         raise OnlyTextMessages
-                    message = self.create_message(webhook_message, bot)
-                    if bot.enabled:
-                        logger.debug("Messenger Bot %s attending request %s" % (bot, message))
-                        handle_messenger_message.delay(message.id, bot.id)
-                    else:
-                        logger.error("Message %s ignored by disabled bot %s" % (message, bot))
+                    if dedup.seen(bot.identity, bot.id, self.message_key(webhook_message)):
+                        logger.warning("Message %s already received by bot %s" % (self.message_key(webhook_message), hook_id))
+                        continue
+                    message = self.build_message(webhook_message, bot)
+                    message.dedup_key = self.message_key(webhook_message)
+                    messages.append(message)
                 except OnlyTextMessages:
-                    logger.warning("Not text message %s for bot %s" % (message, hook_id))
+                    logger.warning("Not text message %s for bot %s" % (webhook_message, hook_id))
                 except:
                     exc_info = sys.exc_info()
                     traceback.print_exception(*exc_info)                
                     logger.error("Error processing %s for bot %s" % (webhook_message, hook_id))
+        if messages:
+            messages = self.create_messages(messages, hook_id)
+            if bot.enabled:
+                logger.debug("Messenger Bot %s attending %s messages" % (bot, len(messages)))
+                try:
+                    self.delay_messages(messages, bot)
+                except:
+                    exc_info = sys.exc_info()
+                    traceback.print_exception(*exc_info)
+                    logger.error("Error delaying %s messages for bot %s" % (len(messages), hook_id))
                     return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        return Response(status=status.HTTP_200_OK)        
\ No newline at end of file
+            else:
+                logger.error("Messages %s ignored by disabled bot %s" % (messages, bot))
+        return Response(status=status.HTTP_200_OK)
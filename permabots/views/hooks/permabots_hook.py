@@ -11,6 +11,7 @@ from rest_framework.authentication import TokenAuthentication
 from rest_framework import exceptions
 from django.utils.translation import ugettext_lazy as _
 from rest_framework.exceptions import ParseError
+from permabots import caching
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +22,16 @@ class PermabotsHookView(APIView):
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     
+    def get_hook(self, key):
+        cache_key = caching.generate_key(Hook, key, 'key')
+        if caching.is_not_found(cache_key):
+            raise Hook.DoesNotExist
+        try:
+            return Hook.objects.get(key=key, enabled=True)
+        except Hook.DoesNotExist:
+            caching.set_not_found(cache_key)
+            raise
+    
     def post(self, request, key):
         """
         Process notitication hooks:
@@ -30,7 +41,7 @@ class PermabotsHookView(APIView):
             4. Respond requester
         """
         try:
-            hook = Hook.objects.get(key=key, enabled=True)
+            hook = self.get_hook(key)
         except Hook.DoesNotExist:
             msg = _("Key %s not associated to an enabled hook or bot") % key
             logger.warning(msg)
@@ -4,7 +4,11 @@ from permabots.models import TelegramBot, TelegramUser, TelegramChat, TelegramMe
 from rest_framework.response import Response
 from rest_framework import status
 import logging
-from permabots.tasks import handle_update
+from permabots.tasks import handle_update, flush_updates, handle_update_data
+from permabots import batching
+from permabots import sharding
+from permabots import ingestion
+from permabots import dedup
 from datetime import datetime
 from permabots import caching
 import sys
@@ -84,6 +88,28 @@ class TelegramHookView(APIView):
         caching.set(update)
         return update
     
+    def delay_update_data(self, serializer, bot, hook_id):
+        """
+        Delay processing of the update without storing it.
+        """
+        update = ingestion.build_update(serializer.data, bot)
+        if update is None:
+            logger.warning("Not text message %s for bot %s" % (serializer.data, hook_id))
+        elif bot.enabled:
+            logger.debug("Telegram Bot %s attending update %s" % (bot.token, serializer.data))
+            try:
+                sharding.apply_async(handle_update_data, (dict(serializer.data), bot.id), sharding.chat_queue(bot, update))
+            except:
+                exc_info = sys.exc_info()
+                traceback.print_exception(*exc_info)
+                logger.error("Error delaying %s for bot %s" % (serializer.data, hook_id))
+                # Telegram will deliver it again
+                dedup.forget(bot.identity, bot.id, serializer.data['update_id'])
+                return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        else:
+            logger.error("Update %s ignored by disabled bot %s" % (update, bot.token))
+        return Response(serializer.data, status=status.HTTP_200_OK)
+    
     def post(self, request, hook_id):
         """
         Process Telegram webhook.
@@ -100,11 +126,20 @@ class TelegramHookView(APIView):
             except TelegramBot.DoesNotExist:
                 logger.warning("Hook id %s not associated to an bot" % hook_id)
                 return Response(serializer.errors, status=status.HTTP_404_NOT_FOUND)
+            if dedup.seen(bot.identity, bot.id, serializer.data['update_id']):
+                logger.warning("Update %s already received by bot %s" % (serializer.data['update_id'], hook_id))
+                return Response(serializer.data, status=status.HTTP_200_OK)
+            if ingestion.fast_path_enabled():
+                return self.delay_update_data(serializer, bot, hook_id)
             try:
                 update = self.create_update(serializer, bot)
                 if bot.enabled:
                     logger.debug("Telegram Bot %s attending request %s" % (bot.token, request.data))
-                    handle_update.delay(update.id, bot.id)
+                    if batching.enabled():
+                        if batching.push('telegram', bot.id, update.id):
+                            sharding.apply_async(flush_updates, (bot.id,), sharding.bot_queue(bot), countdown=batching.window())
+                    else:
+                        sharding.apply_async(handle_update, (update.id, bot.id), sharding.chat_queue(bot, update))
                 else:
                     logger.error("Update %s ignored by disabled bot %s" % (update, bot.token))
             except OnlyTextMessages:
@@ -114,6 +149,8 @@ class TelegramHookView(APIView):
                 exc_info = sys.exc_info()
                 traceback.print_exception(*exc_info)                
                 logger.error("Error processing %s for bot %s" % (request.data, hook_id))
+                # Telegram will deliver it again
+                dedup.forget(bot.identity, bot.id, serializer.data['update_id'])
                 return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             else:
                 return Response(serializer.data, status=status.HTTP_200_OK)
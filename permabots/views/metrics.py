@@ -0,0 +1,33 @@
+from rest_framework.views import APIView
+from rest_framework.permissions import IsAdminUser
+from rest_framework.authentication import TokenAuthentication
+from django.http import HttpResponse
+from permabots import metrics
+
+
+class PrometheusMetricsView(APIView):
+    """
+    Cache metrics of this process in Prometheus text format. Requires PERMABOTS_METRICS_BACKEND set to
+    'permabots.metrics.MemoryBackend'.
+    """
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAdminUser,)
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def get(self, request, format=None):
+        backend = metrics.get_backend()
+        lines = []
+        if isinstance(backend, metrics.MemoryBackend):
+            counters, timings = backend.collect()
+            for metric in sorted(set(metric for metric, _ in counters)):
+                name = 'permabots_cache_%s_total' % metric
+                lines.append('# TYPE %s counter' % name)
+                for (counter, family), value in sorted(counters.items()):
+                    if counter == metric:
+                        lines.append('%s{family="%s"} %s' % (name, family, value))
+            if timings:
+                lines.append('# TYPE permabots_cache_fill_seconds summary')
+                for (_, family), (count, total) in sorted(timings.items()):
+                    lines.append('permabots_cache_fill_seconds_sum{family="%s"} %r' % (family, total))
+                    lines.append('permabots_cache_fill_seconds_count{family="%s"} %s' % (family, count))
+        return HttpResponse(''.join(line + '\n' for line in lines), content_type=self.content_type)
@@ -43,6 +43,18 @@ class TestBotAPI(BaseTestAPI):
         self.assertEqual(new_bot.name, 'new_name')
         self.assertBot(data['id'], data['created_at'], data['updated_at'], data['name'], None, None, None, new_bot)
         
+    def test_post_bots_without_context_policy(self):
+        data = self._test_post_list_ok(self._bot_list_url(), Bot, {'name': 'new_name'})
+        new_bot = Bot.objects.get(pk=data['id'])
+        self.assertEqual({'max_states': None, 'max_bytes': None, 'timeout': None}, new_bot.context_policy())
+        self.assertEqual((None, None, None), (data['context_max_states'], data['context_max_bytes'], data['context_timeout']))
+
+    def test_post_bots_with_context_policy(self):
+        data = self._test_post_list_ok(self._bot_list_url(), Bot, {'name': 'new_name', 'context_max_states': 2,
+                                                                   'context_max_bytes': 1024, 'context_timeout': 60})
+        new_bot = Bot.objects.get(pk=data['id'])
+        self.assertEqual({'max_states': 2, 'max_bytes': 1024, 'timeout': 60}, new_bot.context_policy())
+
     def test_post_bots_not_auth(self):
         self._test_post_list_not_auth(self._bot_list_url(), {'name': 'new_name'})
         
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from permabots.test import factories, testcases
+from permabots import batching, tasks
+from django.test import override_settings
+from django.core.cache import cache
+try:
+    from unittest import mock
+except ImportError:
+    import mock  # noqa
+
+
+class TestBatching(testcases.TelegramTestBot):
+
+    no_request = {'in': '/norequest',
+                  'out': {'parse_mode': 'HTML',
+                          'reply_markup': '',
+                          'text': 'Just plain response'
+                          }
+                  }
+
+    def setUp(self):
+        super(TestBatching, self).setUp()
+        cache.clear()
+
+    def test_pop_in_order(self):
+        self.assertTrue(batching.push('telegram', self.bot.pk, 'a'))
+        self.assertFalse(batching.push('telegram', self.bot.pk, 'b'))
+        self.assertEqual(['a', 'b'], batching.pop_all('telegram', self.bot.pk))
+        self.assertEqual([], batching.pop_all('telegram', self.bot.pk))
+        self.assertTrue(batching.push('telegram', self.bot.pk, 'c'))
+        self.assertEqual(['c'], batching.pop_all('telegram', self.bot.pk))
+
+    def test_item_not_stored_yet_left_for_next_pop(self):
+        batching.push('telegram', self.bot.pk, 'a')
+        # Concurrent push between sequence increment and item store
+        index = cache.incr(batching._key('telegram', self.bot.pk, 'sequence'))
+        self.assertEqual(['a'], batching.pop_all('telegram', self.bot.pk))
+        self.assertTrue(batching.reschedule('telegram', self.bot.pk))
+        cache.set(batching._key('telegram', self.bot.pk, 'item_%d' % index), 'b')
+        self.assertEqual(['b'], batching.pop_all('telegram', self.bot.pk))
+        self.assertFalse(batching.reschedule('telegram', self.bot.pk))
+
+    def test_lost_item_skipped_by_next_pop(self):
+        batching.push('telegram', self.bot.pk, 'a')
+        batching.push('telegram', self.bot.pk, 'b')
+        cache.delete(batching._key('telegram', self.bot.pk, 'item_1'))
+        self.assertEqual([], batching.pop_all('telegram', self.bot.pk))
+        self.assertEqual(['b'], batching.pop_all('telegram', self.bot.pk))
+        self.assertEqual(0, batching.pending('telegram', self.bot.pk))
+
+    def test_pop_locked(self):
+        batching.push('telegram', self.bot.pk, 'a')
+        cache.add(batching._key('telegram', self.bot.pk, 'lock'), True)
+        self.assertEqual(None, batching.pop_all('telegram', self.bot.pk))
+
+    @override_settings(PERMABOTS_BATCH_TASKS=True)
+    def test_batched_update(self):
+        self.response = factories.ResponseFactory(text_template='Just plain response',
+                                                  keyboard_template='')
+        self.handler = factories.HandlerFactory(bot=self.bot,
+                                                pattern='/norequest',
+                                                response=self.response)
+        with mock.patch("permabots.tasks.handle_update.delay", callable=mock.MagicMock()) as mock_handle:
+            self._test_message(self.no_request)
+            self.assertEqual(0, mock_handle.call_count)
+
+    @override_settings(PERMABOTS_BATCH_TASKS=True)
+    def test_flush_handles_updates_in_arrival_order(self):
+        for text in ('first', 'second'):
+            response = factories.ResponseFactory(text_template='%s response' % text.capitalize(), keyboard_template='')
+            factories.HandlerFactory(bot=self.bot, pattern='/%s' % text, response=response)
+        with mock.patch(self.send_message_to_patch, callable=mock.MagicMock()) as mock_send:
+            with mock.patch("permabots.tasks.flush_updates.apply_async", callable=mock.MagicMock()) as mock_flush:
+                for text in ('/second', '/first'):
+                    self.set_text(text, self.message_api)
+                    self.client.post(self.webhook_url, self.to_send(self.message_api), **self.kwargs)
+                    self.message_api.update_id += 1
+                    self.message_api.message.message_id += 1
+                self.assertEqual(1, mock_flush.call_count)
+                self.assertEqual(0, mock_send.call_count)
+                tasks.flush_updates(self.bot.telegram_bot.pk)
+            self.assertEqual(['Second response', 'First response'], [kwargs['text'] for _, kwargs in mock_send.call_args_list])
+        self.assertEqual([], batching.pop_all('telegram', self.bot.telegram_bot.pk))
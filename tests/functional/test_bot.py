@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from permabots.models import Bot, TelegramBot, KikBot, MessengerBot
-from permabots.test import testcases
+from permabots.models import Bot, TelegramBot, KikBot, MessengerBot, MessengerMessage, KikMessage, KikUser, KikChat
+from permabots.test import testcases, factories
+from permabots.views.hooks.messenger_hook import MessengerHookView
 from django.core.urlresolvers import reverse
 from rest_framework import status
 from django.core.exceptions import ValidationError
 from django.test import override_settings
+import json
+import uuid
 try:
     from unittest import mock
 except ImportError:
@@ -119,6 +122,25 @@ class TestKikBot(testcases.KikTestBot):
                 self.assertEqual(status.HTTP_200_OK, response.status_code)
                 self.assertEqual(0, mock_send.call_count)
         
+    def _kik_message_json(self, chat_id, type='text'):
+        return {'id': str(uuid.uuid4()), 'chatId': chat_id, 'from': 'user1', 'participants': ['user1', 'user2'],
+                'timestamp': 1467000000000, 'body': 'text', 'type': type}
+        
+    def test_messages_created_together(self):
+        messages = [self._kik_message_json('chat1'), self._kik_message_json('chat1', type='picture'),
+                    self._kik_message_json('chat1'), self._kik_message_json('chat2')]
+        with mock.patch('kik.api.KikApi.verify_signature', callable=mock.MagicMock()) as mock_verify:
+            mock_verify.return_value = True
+            with mock.patch("permabots.tasks.handle_message.apply_async", callable=mock.MagicMock()) as mock_single:
+                with mock.patch("permabots.tasks.handle_messages.apply_async", callable=mock.MagicMock()) as mock_batch:
+                    response = self.client.post(self.kik_webhook_url, json.dumps({'messages': messages}), **self.kwargs)
+                    self.assertEqual(status.HTTP_200_OK, response.status_code)
+                    self.assertEqual(1, mock_single.call_count)
+                    self.assertEqual(1, mock_batch.call_count)
+        self.assertEqual(3, KikMessage.objects.count())
+        self.assertEqual(2, KikUser.objects.count())
+        self.assertEqual(2, KikChat.objects.get(id='chat1').participants.count())
+        
     def test_webhook_domain_auto_site(self):
         from django.contrib.sites.models import Site
         current_site = Site.objects.get_current()
@@ -161,6 +183,37 @@ class TestMessengerBot(testcases.MessengerTestBot):
             self.assertEqual(status.HTTP_200_OK, response.status_code)
             self.assertEqual(0, mock_send.call_count)
             
+    def test_messages_grouped_by_sender(self):
+        other_sender_message = factories.MessengerMessagingFactory()
+        same_sender_message = factories.MessengerMessagingFactory(sender=self.messenger_text_message.sender)
+        self.messenger_entry.messaging = [self.messenger_text_message, other_sender_message, same_sender_message]
+        with mock.patch("permabots.tasks.handle_messenger_message.apply_async", callable=mock.MagicMock()) as mock_single:
+            with mock.patch("permabots.tasks.handle_messenger_messages.apply_async", callable=mock.MagicMock()) as mock_batch:
+                response = self.client.post(self.messenger_webhook_url, self.to_send(self.messenger_webhook_message), **self.kwargs)
+                self.assertEqual(status.HTTP_200_OK, response.status_code)
+                self.assertEqual(1, mock_single.call_count)
+                self.assertEqual(1, mock_batch.call_count)
+                args, kwargs = mock_batch.call_args
+                self.assertEqual(2, len(args[0][0]))
+        self.assertEqual(3, MessengerMessage.objects.count())
+        
+    def test_wrong_message_not_discarding_others(self):
+        wrong_message = factories.MessengerMessagingFactory()
+        self.messenger_entry.messaging = [wrong_message, self.messenger_text_message]
+        build_message = MessengerHookView.build_message
+        
+        def fail_wrong_message(view, webhook_message, bot):
+            if webhook_message.sender == wrong_message.sender:
+                raise ValueError
+            return build_message(view, webhook_message, bot)
+        
+        with mock.patch.object(MessengerHookView, 'build_message', fail_wrong_message):
+            with mock.patch("permabots.tasks.handle_messenger_message.apply_async", callable=mock.MagicMock()) as mock_send:
+                response = self.client.post(self.messenger_webhook_url, self.to_send(self.messenger_webhook_message), **self.kwargs)
+                self.assertEqual(status.HTTP_200_OK, response.status_code)
+                self.assertEqual(1, mock_send.call_count)
+        self.assertEqual(1, MessengerMessage.objects.count())
+            
     def test_bot_verify_ok(self):
         response = self.client.get(self.messenger_webhook_url, {'hub.mode': 'subscribe', 'hub.challenge': 12345, 'hub.verify_token': self.bot.messenger_bot.id})
         self.assertEqual(status.HTTP_200_OK, response.status_code)
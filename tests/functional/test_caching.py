@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from permabots.models import Bot, TelegramBot, EnvironmentVar, TelegramUser, Hook
+from permabots.test import factories, testcases
+from permabots import caching, metrics, snapshot
+from permabots.views.hooks.permabots_hook import PermabotsHookView
+from django.test import override_settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+from rest_framework import status
+import uuid
+
+
+@override_settings(PERMABOTS_LOCAL_CACHE_SIZE=10)
+class TestLocalCache(testcases.BaseTestBot):
+
+    def setUp(self):
+        super(TestLocalCache, self).setUp()
+        cache.clear()
+        caching.clear_local()
+
+    def tearDown(self):
+        caching.clear_local()
+        super(TestLocalCache, self).tearDown()
+
+    def test_bot_served_from_local(self):
+        telegram_bot = caching.get_or_set(TelegramBot, self.bot.telegram_bot.pk)
+        cache.delete(caching.generate_key(TelegramBot, telegram_bot.pk))
+        with self.assertNumQueries(0):
+            self.assertIs(telegram_bot, caching.get_or_set(TelegramBot, telegram_bot.pk))
+
+    @override_settings(PERMABOTS_LOCAL_CACHE_CHECK_INTERVAL=0)
+    def test_other_process_change_drops_local(self):
+        caching.get_or_set(Bot, self.bot.pk)
+        key = caching.generate_key(Bot, self.bot.pk)
+        self.assertIsNotNone(caching.local_get(key))
+        cache.set(caching.LOCAL_VERSION_KEY, 'changed by other process')
+        self.assertIsNone(caching.local_get(key))
+
+    @override_settings(PERMABOTS_LOCAL_CACHE_SIZE=1)
+    def test_least_recently_used_removed(self):
+        caching.get_or_set(TelegramBot, self.bot.telegram_bot.pk)
+        caching.get_or_set(Bot, self.bot.pk)
+        self.assertIsNone(caching.local_get(caching.generate_key(TelegramBot, self.bot.telegram_bot.pk)))
+        self.assertIsNotNone(caching.local_get(caching.generate_key(Bot, self.bot.pk)))
+
+    @override_settings(PERMABOTS_LOCAL_CACHE_TIMEOUT=-1)
+    def test_expired(self):
+        caching.get_or_set(Bot, self.bot.pk)
+        self.assertIsNone(caching.local_get(caching.generate_key(Bot, self.bot.pk)))
+
+    @override_settings(PERMABOTS_LOCAL_CACHE_SIZE=0)
+    def test_disabled(self):
+        caching.get_or_set(Bot, self.bot.pk)
+        self.assertEqual(0, len(caching._local))
+
+    def test_messages_not_local(self):
+        update = factories.TelegramUpdateAPIFactory(bot=self.bot.telegram_bot)
+        caching.get_or_set(update._meta.model, update.pk)
+        self.assertEqual(0, len(caching._local))
+
+
+class TestConfigVersion(testcases.BaseTestBot):
+
+    def setUp(self):
+        super(TestConfigVersion, self).setUp()
+        cache.clear()
+
+    def test_version_kept(self):
+        self.assertEqual(caching.config_version(self.bot), caching.config_version(self.bot))
+
+    def test_bumped_by_configuration_changes(self):
+        version = caching.config_version(self.bot)
+        state = factories.StateFactory(bot=self.bot)
+        self.assertNotEqual(version, caching.config_version(self.bot))
+        version = caching.config_version(self.bot)
+        EnvironmentVar.objects.create(bot=self.bot, key='shop', value='bookshop')
+        self.assertNotEqual(version, caching.config_version(self.bot))
+        version = caching.config_version(self.bot)
+        handler = factories.HandlerFactory(bot=self.bot)
+        self.assertNotEqual(version, caching.config_version(self.bot))
+        version = caching.config_version(self.bot)
+        handler.source_states.add(state)
+        self.assertNotEqual(version, caching.config_version(self.bot))
+        version = caching.config_version(self.bot)
+        handler.response.text_template = 'changed'
+        handler.response.save()
+        self.assertNotEqual(version, caching.config_version(self.bot))
+
+    def test_other_bots_not_changed(self):
+        other_bot = factories.BotFactory()
+        version = caching.config_version(other_bot)
+        factories.StateFactory(bot=self.bot)
+        self.assertEqual(version, caching.config_version(other_bot))
+
+
+class TestNotFoundCache(testcases.BaseTestBot):
+
+    def setUp(self):
+        super(TestNotFoundCache, self).setUp()
+        cache.clear()
+
+    def test_unknown_bot_without_queries(self):
+        url = reverse('permabots:telegrambot', kwargs={'hook_id': uuid.uuid4()})
+        response = self.client.post(url, self.telegram_update.to_json(), **self.kwargs)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        with self.assertNumQueries(0):
+            response = self.client.post(url, self.telegram_update.to_json(), **self.kwargs)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_found_when_created(self):
+        with self.assertRaises(TelegramUser.DoesNotExist):
+            caching.get_or_set(TelegramUser, 12345)
+        user = factories.TelegramUserAPIFactory(id=12345)
+        self.assertEqual(user, caching.get_or_set(TelegramUser, 12345))
+
+    @override_settings(PERMABOTS_NOT_FOUND_TIMEOUT=0)
+    def test_disabled(self):
+        with self.assertRaises(TelegramUser.DoesNotExist):
+            caching.get_or_set(TelegramUser, 12345)
+        self.assertIsNone(cache.get(caching.generate_key(TelegramUser, 12345)))
+
+    def test_unknown_hook_without_queries(self):
+        view = PermabotsHookView()
+        with self.assertRaises(Hook.DoesNotExist):
+            view.get_hook('unknownkey')
+        with self.assertNumQueries(0):
+            with self.assertRaises(Hook.DoesNotExist):
+                view.get_hook('unknownkey')
+
+    def test_hook_found_when_enabled(self):
+        hook = factories.HookFactory(bot=self.bot, enabled=False)
+        with self.assertRaises(Hook.DoesNotExist):
+            PermabotsHookView().get_hook(hook.key)
+        hook.enabled = True
+        hook.save()
+        self.assertEqual(hook, PermabotsHookView().get_hook(hook.key))
+
+
+@override_settings(PERMABOTS_METRICS_BACKEND='permabots.metrics.MemoryBackend')
+class TestCacheMetrics(testcases.BaseTestBot):
+
+    def setUp(self):
+        super(TestCacheMetrics, self).setUp()
+        cache.clear()
+        self.backend = metrics.get_backend()
+        self.backend.reset()
+
+    def test_hits_and_misses(self):
+        caching.get_or_set(TelegramBot, self.bot.telegram_bot.pk)
+        caching.get_or_set(TelegramBot, self.bot.telegram_bot.pk)
+        snapshot.get(self.bot)
+        counters, timings = self.backend.collect()
+        self.assertEqual(1, counters[('misses', 'telegrambot')])
+        self.assertEqual(1, counters[('hits', 'telegrambot')])
+        self.assertTrue(counters[('payload_bytes', 'telegrambot')] > 0)
+        self.assertEqual(1, counters[('misses', 'snapshot')])
+        self.assertEqual(1, timings[('fill', 'telegrambot')][0])
+
+    @override_settings(PERMABOTS_LOCAL_CACHE_SIZE=10)
+    def test_local_hits(self):
+        caching.clear_local()
+        try:
+            caching.get_or_set(TelegramBot, self.bot.telegram_bot.pk)
+            caching.get_or_set(TelegramBot, self.bot.telegram_bot.pk)
+        finally:
+            caching.clear_local()
+        counters, _ = self.backend.collect()
+        self.assertEqual(1, counters[('local_hits', 'telegrambot')])
+        self.assertNotIn(('hits', 'telegrambot'), counters)
+
+    @override_settings(PERMABOTS_METRICS_BACKEND=None)
+    def test_disabled(self):
+        caching.get_or_set(TelegramBot, self.bot.telegram_bot.pk)
+        self.assertEqual(({}, {}), self.backend.collect())
+
+    def test_prometheus_view(self):
+        caching.get_or_set(TelegramBot, self.bot.telegram_bot.pk)
+        user = get_user_model().objects.create_superuser('admin', 'admin@test.com', 'password')
+        response = self.client.get(reverse('metrics:metrics'), HTTP_AUTHORIZATION='Token %s' % Token.objects.get(user=user).key)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertIn('permabots_cache_misses_total{family="telegrambot"} 1\n', response.content.decode('utf-8'))
+        self.assertIn('permabots_cache_fill_seconds_count{family="telegrambot"} 1\n', response.content.decode('utf-8'))
+
+    def test_prometheus_view_only_admin(self):
+        response = self.client.get(reverse('metrics:metrics'), HTTP_AUTHORIZATION='Token %s' % Token.objects.get(user=self.bot.owner).key)
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
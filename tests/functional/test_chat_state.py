@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from permabots.models import ChatState, TelegramChatState, KikChatState, MessengerChatState, StateContext
+from permabots.test import factories, testcases
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.core.management import call_command
+from django.test import override_settings
+from six import StringIO
+
+
+class TestChatStateCache(testcases.TelegramTestBot):
+
+    def setUp(self):
+        super(TestChatStateCache, self).setUp()
+        cache.clear()
+        self.telegram_bot = self.bot.telegram_bot
+        self.update = factories.TelegramUpdateAPIFactory(bot=self.telegram_bot)
+        self.state = factories.StateFactory(bot=self.bot)
+
+    def test_chat_state_cached(self):
+        chat_state = factories.TelegramChatStateFactory(chat=self.update.message.chat, user=self.update.message.from_user,
+                                                        state=self.state)
+        cache.clear()
+        self.assertEqual(chat_state, self.telegram_bot.get_chat_state(self.update))
+        with self.assertNumQueries(0):
+            self.assertEqual(chat_state, self.telegram_bot.get_chat_state(self.update))
+
+    def test_not_found_cached(self):
+        self.assertEqual(None, self.telegram_bot.get_chat_state(self.update))
+        with self.assertNumQueries(0):
+            self.assertEqual(None, self.telegram_bot.get_chat_state(self.update))
+
+    def test_write_through(self):
+        self.assertEqual(None, self.telegram_bot.get_chat_state(self.update))
+        self.telegram_bot.create_chat_state(self.update, self.state, {'_start': {'var': 1}})
+        with self.assertNumQueries(0):
+            chat_state = self.telegram_bot.get_chat_state(self.update)
+        self.assertEqual(self.state, chat_state.state)
+        chat_state.ctx = {'_start': {'var': 2}}
+        chat_state.save()
+        with self.assertNumQueries(0):
+            self.assertEqual({'_start': {'var': 2}}, self.telegram_bot.get_chat_state(self.update).ctx)
+
+    def test_deleted(self):
+        chat_state = factories.TelegramChatStateFactory(chat=self.update.message.chat, user=self.update.message.from_user,
+                                                        state=self.state)
+        chat_state.delete()
+        self.assertEqual(None, self.telegram_bot.get_chat_state(self.update))
+        self.assertEqual(0, TelegramChatState.objects.count())
+
+    def test_old_key_deleted_when_chat_changes(self):
+        chat_state = factories.TelegramChatStateFactory(chat=self.update.message.chat, user=self.update.message.from_user,
+                                                        state=self.state)
+        self.assertEqual(chat_state, self.telegram_bot.get_chat_state(self.update))
+        chat_state = TelegramChatState.objects.get(pk=chat_state.pk)
+        chat_state.chat = factories.TelegramChatAPIFactory()
+        chat_state.save()
+        self.assertEqual(None, self.telegram_bot.get_chat_state(self.update))
+
+    def test_deleted_when_state_changes(self):
+        chat_state = factories.TelegramChatStateFactory(chat=self.update.message.chat, user=self.update.message.from_user,
+                                                        state=self.state)
+        self.telegram_bot.get_chat_state(self.update)
+        self.state.name = 'renamed'
+        self.state.save()
+        self.assertIsNone(cache.get(chat_state.get_cache_key()))
+        self.assertEqual('renamed', self.telegram_bot.get_chat_state(self.update).state.name)
+        self.state.delete()
+        self.assertEqual(None, self.telegram_bot.get_chat_state(self.update))
+
+
+class TestContextPruning(testcases.TelegramTestBot):
+
+    def setUp(self):
+        super(TestContextPruning, self).setUp()
+        self.state = factories.StateFactory(bot=self.bot)
+        self.chat_state = factories.TelegramChatStateFactory(state=self.state,
+                                                             context={'state1': {'var': 1}, 'state2': {'var': 2}, 'state3': {'var': 3}},
+                                                             context_timestamps={'state1': 100, 'state2': 200, 'state3': 300})
+
+    def test_no_policy(self):
+        self.assertFalse(self.chat_state.prune_context())
+        self.assertEqual(3, len(self.chat_state.ctx))
+
+    def test_max_states(self):
+        self.assertTrue(self.chat_state.prune_context(max_states=2))
+        self.assertEqual(['state2', 'state3'], sorted(self.chat_state.ctx.keys()))
+        self.assertEqual(['state2', 'state3'], sorted(self.chat_state.context_timestamps.keys()))
+
+    def test_max_bytes(self):
+        self.assertTrue(self.chat_state.prune_context(max_bytes=1))
+        self.assertEqual(['state3'], list(self.chat_state.ctx.keys()))
+
+    def test_timeout(self):
+        self.assertTrue(self.chat_state.prune_context(timeout=150, now=400))
+        self.assertEqual(['state3'], list(self.chat_state.ctx.keys()))
+        self.assertFalse(self.chat_state.prune_context(timeout=150, now=400))
+
+    def test_pruned_on_update(self):
+        self.bot.context_max_states = 2
+        self.bot.save()
+        new_state = factories.StateFactory(bot=self.bot)
+        self.bot.update_chat_state(self.bot.telegram_bot, None, self.chat_state, new_state, {'var': 4})
+        chat_state = TelegramChatState.objects.get(pk=self.chat_state.pk)
+        self.assertEqual(new_state, chat_state.state)
+        self.assertEqual(sorted(['state3', self.state.name]), sorted(chat_state.ctx.keys()))
+
+    def test_compact_command(self):
+        self.bot.context_max_states = 1
+        self.bot.save()
+        out = StringIO()
+        call_command('compact_chat_states', stdout=out)
+        self.assertIn('1 chat states compacted', out.getvalue())
+        self.assertEqual(['state3'], list(TelegramChatState.objects.get(pk=self.chat_state.pk).ctx.keys()))
+
+
+@override_settings(PERMABOTS_CONTEXT_DELTAS=True)
+class TestContextDeltas(testcases.TelegramTestBot):
+
+    def setUp(self):
+        super(TestContextDeltas, self).setUp()
+        self.state = factories.StateFactory(bot=self.bot)
+        self.chat_state = factories.TelegramChatStateFactory(state=self.state, context={'state1': {'var': 1}},
+                                                             context_timestamps={'state1': 100})
+
+    def update(self, context):
+        new_state = factories.StateFactory(bot=self.bot)
+        self.bot.update_chat_state(self.bot.telegram_bot, None, self.chat_state, new_state, context)
+        return new_state
+
+    def test_only_new_state_context_written(self):
+        state_name = self.state.name.lower().replace(" ", "_")
+        self.update({'var': 2})
+        chat_state = TelegramChatState.objects.get(pk=self.chat_state.pk)
+        self.assertEqual({'state1': {'var': 1}}, chat_state.context)
+        self.assertEqual({'state1': {'var': 1}, state_name: {'var': 2}}, chat_state.ctx)
+        self.assertEqual({'var': 2}, StateContext.objects.get(chat_state_id=chat_state.pk, state_name=state_name).context)
+
+    def test_inline_context_moved_on_change(self):
+        self.chat_state.state.name = 'state1'
+        self.update({'var': 2})
+        chat_state = TelegramChatState.objects.get(pk=self.chat_state.pk)
+        self.assertEqual({}, chat_state.context)
+        self.assertEqual({'state1': {'var': 2}}, chat_state.ctx)
+
+    def test_pruned_rows_deleted(self):
+        self.bot.context_max_states = 1
+        self.bot.save()
+        self.update({'var': 2})
+        self.update({'var': 3})
+        self.assertEqual(1, StateContext.objects.filter(chat_state_id=self.chat_state.pk).count())
+        self.assertEqual(1, len(TelegramChatState.objects.get(pk=self.chat_state.pk).ctx))
+
+    def test_context_replaced(self):
+        self.update({'var': 2})
+        chat_state = TelegramChatState.objects.get(pk=self.chat_state.pk)
+        chat_state.ctx = {'state1': {'var': 5}}
+        chat_state.save()
+        self.assertEqual({'state1': {'var': 5}}, TelegramChatState.objects.get(pk=self.chat_state.pk).ctx)
+        self.assertFalse(StateContext.objects.exists())
+
+    def test_rows_kept_when_context_not_replaced(self):
+        self.update({'var': 2})
+        chat_state = TelegramChatState.objects.get(pk=self.chat_state.pk)
+        context = chat_state.ctx
+        chat_state.save()
+        self.assertEqual(context, TelegramChatState.objects.get(pk=self.chat_state.pk).ctx)
+
+    def test_rows_deleted_with_chat_state(self):
+        self.update({'var': 2})
+        self.chat_state.delete()
+        self.assertFalse(StateContext.objects.exists())
+
+
+class TestChatStateServices(testcases.TelegramTestBot):
+
+    def setUp(self):
+        super(TestChatStateServices, self).setUp()
+        self.state = factories.StateFactory(bot=self.bot)
+
+    def test_one_table_for_services(self):
+        telegram_chat_state = factories.TelegramChatStateFactory(state=self.state)
+        messenger_chat_state = factories.MessengerChatStateFactory(state=self.state, chat=telegram_chat_state.chat_key)
+        self.assertEqual(2, ChatState.objects.filter(bot=self.bot).count())
+        self.assertEqual([telegram_chat_state], list(TelegramChatState.objects.all()))
+        self.assertEqual([messenger_chat_state], list(MessengerChatState.objects.all()))
+        self.assertEqual(ChatState.TELEGRAM, telegram_chat_state.service)
+        self.assertEqual(self.bot, messenger_chat_state.bot)
+
+    def test_chat_and_user_from_keys(self):
+        chat_state = factories.TelegramChatStateFactory(state=self.state)
+        chat_state = TelegramChatState.objects.get(pk=chat_state.pk)
+        self.assertEqual(str(chat_state.chat.id), chat_state.chat_key)
+        self.assertEqual(str(chat_state.user.id), chat_state.user_key)
+
+    def test_deleted_with_chat(self):
+        chat_state = factories.TelegramChatStateFactory(state=self.state)
+        other_chat_state = factories.TelegramChatStateFactory(state=self.state)
+        chat_state.chat.delete()
+        self.assertEqual([other_chat_state], list(TelegramChatState.objects.all()))
+        self.assertIsNone(cache.get(chat_state.get_cache_key()))
+
+    def test_deleted_with_user(self):
+        chat_state = factories.KikChatStateFactory(state=self.state)
+        chat_state.user.delete()
+        self.assertEqual(0, KikChatState.objects.count())
+
+    def test_unique_chat_state(self):
+        chat_state = factories.TelegramChatStateFactory(state=self.state)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                factories.TelegramChatStateFactory(state=self.state, chat=chat_state.chat, user=chat_state.user)
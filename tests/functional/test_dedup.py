@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from permabots.models import TelegramUpdate, KikMessage, MessengerMessage
+from permabots.test import testcases
+from django.test import override_settings
+from django.core.cache import cache
+from rest_framework import status
+try:
+    from unittest import mock
+except ImportError:
+    import mock  # noqa
+
+
+@override_settings(PERMABOTS_DEDUP_TIMEOUT=60)
+class TestTelegramDedup(testcases.TelegramTestBot):
+
+    def setUp(self):
+        super(TestTelegramDedup, self).setUp()
+        cache.clear()
+
+    def test_redelivered_update_discarded(self):
+        with mock.patch("permabots.tasks.handle_update.apply_async", callable=mock.MagicMock()) as mock_handle:
+            data = self.to_send(self.message_api)
+            for _ in range(2):
+                response = self.client.post(self.webhook_url, data, **self.kwargs)
+                self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(1, mock_handle.call_count)
+        self.assertEqual(1, TelegramUpdate.objects.count())
+
+    @override_settings(PERMABOTS_TELEGRAM_FAST_PATH=True)
+    def test_redelivered_update_processed_when_delay_failed(self):
+        data = self.to_send(self.message_api)
+        with mock.patch("permabots.tasks.handle_update_data.delay", side_effect=Exception("Broker down")):
+            response = self.client.post(self.webhook_url, data, **self.kwargs)
+            self.assertEqual(status.HTTP_500_INTERNAL_SERVER_ERROR, response.status_code)
+        with mock.patch("permabots.tasks.handle_update_data.delay", callable=mock.MagicMock()) as mock_handle:
+            response = self.client.post(self.webhook_url, data, **self.kwargs)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(1, mock_handle.call_count)
+
+    @override_settings(PERMABOTS_DEDUP_TIMEOUT=None)
+    def test_disabled(self):
+        with mock.patch("permabots.tasks.handle_update.apply_async", callable=mock.MagicMock()) as mock_handle:
+            for _ in range(2):
+                self.client.post(self.webhook_url, self.to_send(self.message_api), **self.kwargs)
+            self.assertEqual(2, mock_handle.call_count)
+
+
+@override_settings(PERMABOTS_DEDUP_TIMEOUT=60)
+class TestKikDedup(testcases.KikTestBot):
+
+    def setUp(self):
+        super(TestKikDedup, self).setUp()
+        cache.clear()
+
+    def test_redelivered_message_discarded(self):
+        with mock.patch('kik.api.KikApi.verify_signature', callable=mock.MagicMock()) as mock_verify:
+            mock_verify.return_value = True
+            with mock.patch("permabots.tasks.handle_message.apply_async", callable=mock.MagicMock()) as mock_handle:
+                data = self.to_send(self.message_api)
+                for _ in range(2):
+                    response = self.client.post(self.webhook_url, data, **self.kwargs)
+                    self.assertEqual(status.HTTP_200_OK, response.status_code)
+                self.assertEqual(1, mock_handle.call_count)
+        self.assertEqual(1, KikMessage.objects.count())
+
+    def test_redelivered_message_processed_when_delay_failed(self):
+        with mock.patch('kik.api.KikApi.verify_signature', callable=mock.MagicMock()) as mock_verify:
+            mock_verify.return_value = True
+            data = self.to_send(self.message_api)
+            with mock.patch("permabots.tasks.handle_message.delay", side_effect=Exception("Broker down")):
+                response = self.client.post(self.webhook_url, data, **self.kwargs)
+                self.assertEqual(status.HTTP_500_INTERNAL_SERVER_ERROR, response.status_code)
+            with mock.patch("permabots.tasks.handle_message.delay", callable=mock.MagicMock()) as mock_handle:
+                response = self.client.post(self.webhook_url, data, **self.kwargs)
+                self.assertEqual(status.HTTP_200_OK, response.status_code)
+                self.assertEqual(1, mock_handle.call_count)
+
+
+@override_settings(PERMABOTS_DEDUP_TIMEOUT=60)
+class TestMessengerDedup(testcases.MessengerTestBot):
+
+    def setUp(self):
+        super(TestMessengerDedup, self).setUp()
+        cache.clear()
+
+    def test_redelivered_message_discarded(self):
+        with mock.patch("permabots.tasks.handle_messenger_message.apply_async", callable=mock.MagicMock()) as mock_handle:
+            data = self.to_send(self.message_api)
+            for _ in range(2):
+                response = self.client.post(self.webhook_url, data, **self.kwargs)
+                self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(1, mock_handle.call_count)
+        self.assertEqual(1, MessengerMessage.objects.count())
+
+    def test_redelivered_message_processed_when_delay_failed(self):
+        data = self.to_send(self.message_api)
+        with mock.patch("permabots.tasks.handle_messenger_message.delay", side_effect=Exception("Broker down")):
+            response = self.client.post(self.webhook_url, data, **self.kwargs)
+            self.assertEqual(status.HTTP_500_INTERNAL_SERVER_ERROR, response.status_code)
+        with mock.patch("permabots.tasks.handle_messenger_message.delay", callable=mock.MagicMock()) as mock_handle:
+            response = self.client.post(self.webhook_url, data, **self.kwargs)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(1, mock_handle.call_count)
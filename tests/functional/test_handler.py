@@ -281,6 +281,23 @@ class TestRequests(LiveServerTestCase, testcases.TelegramTestBot):
                                                 request=self.request,
                                                 response=self.response)
         self._test_message(self.author_get)
+        
+    def test_get_request_cached(self):
+        author = Author.objects.create(name="author1")
+        self.request = factories.RequestFactory(url_template=self.live_server_url + '/api/authors/',
+                                                method=Request.GET,
+                                                cache_timeout=60)
+        self.response = factories.ResponseFactory(text_template='{% for author in response.data %}<b>{{author.name}}</b>{% endfor %}',
+                                                  keyboard_template='')
+        self.handler = factories.HandlerFactory(bot=self.bot,
+                                                pattern='/authors',
+                                                request=self.request,
+                                                response=self.response)
+        self._test_message(self.author_get)
+        author.name = "author2"
+        author.save()
+        self._test_message(self.author_get)
+        self.assertEqual({'hits': 1, 'misses': 1, 'stale': 0}, self.request.cache_stats())
    
     def test_get_pattern_command(self):
         Author.objects.create(name="author1")
@@ -530,8 +547,8 @@ class TestRequests(LiveServerTestCase, testcases.TelegramTestBot):
                                                              user=self.user)
         
         self._test_message(self.author_get)
-        self.assertEqual(TelegramChatState.objects.get(chat=self.chat).state, self.state_target)
-        state_context = TelegramChatState.objects.get(chat=self.chat).ctx
+        self.assertEqual(TelegramChatState.objects.get(chat_key=self.chat.pk).state, self.state_target)
+        state_context = TelegramChatState.objects.get(chat_key=self.chat.pk).ctx
         self.assertEqual(state_context['state1']['pattern'], {})
         self.assertEqual(state_context['state1']['response']['data'][0], {'name': 'author1'})
         self.assertEqual(None, state_context['state1'].get('state_context', None))
@@ -568,7 +585,7 @@ class TestRequests(LiveServerTestCase, testcases.TelegramTestBot):
                                                              user=self.user)
         
         self._test_message(self.author_get_pattern_not_found)
-        self.assertEqual(TelegramChatState.objects.get(chat=self.chat).state, self.state)
+        self.assertEqual(TelegramChatState.objects.get(chat_key=self.chat.pk).state, self.state)
 
     def test_handler_with_state_still_no_chatstate(self):
         Author.objects.create(name="author1")
@@ -594,8 +611,8 @@ class TestRequests(LiveServerTestCase, testcases.TelegramTestBot):
                                                      last_name=self.telegram_update.message.chat.last_name)
         
         self._test_message(self.author_get)
-        self.assertEqual(TelegramChatState.objects.get(chat=self.chat).state, self.state_target)
-        state_context = TelegramChatState.objects.get(chat=self.chat).ctx
+        self.assertEqual(TelegramChatState.objects.get(chat_key=self.chat.pk).state, self.state_target)
+        state_context = TelegramChatState.objects.get(chat_key=self.chat.pk).ctx
         self.assertEqual(state_context['_start']['pattern'], {})
         self.assertEqual(state_context['_start']['response']['data'][0], {'name': 'author1'})
         self.assertEqual(None, state_context['_start'].get('state_context', None))
@@ -635,8 +652,8 @@ class TestRequests(LiveServerTestCase, testcases.TelegramTestBot):
                                                                        user=self.user)
         self._test_message(self.author_get)
         self.assertEqual(TelegramChatState.objects.count(), 2)
-        self.assertEqual(TelegramChatState.objects.get(chat=self.chat, state__bot=self.bot).state, self.state_target)
-        state_context = TelegramChatState.objects.get(chat=self.chat, state__bot=self.bot).ctx
+        self.assertEqual(TelegramChatState.objects.get(chat_key=self.chat.pk, bot=self.bot).state, self.state_target)
+        state_context = TelegramChatState.objects.get(chat_key=self.chat.pk, bot=self.bot).ctx
         self.assertEqual(state_context['_start']['pattern'], {})
         self.assertEqual(state_context['_start']['response']['data'][0], {'name': 'author1'})
         self.assertEqual(None, state_context['_start'].get('state_context', None))
@@ -701,10 +718,13 @@ class TestRequests(LiveServerTestCase, testcases.TelegramTestBot):
         self.chat_state = factories.TelegramChatStateFactory(chat=self.chat,
                                                              state=self.state,
                                                              user=self.user,
-                                                             context='{"prev_state": {"var":"in_context"}}')
-        self.assertEqual(json.loads(self.chat_state.context), self.chat_state.ctx)
+                                                             context={"prev_state": {"var": "in_context"}})
+        self.assertEqual(self.chat_state.context, self.chat_state.ctx)
         self._test_message(self.author_get_with_state_context)
-        self.assertEqual(TelegramChatState.objects.get(chat=self.chat).state, self.state_target)
+        chat_state = TelegramChatState.objects.get(chat_key=self.chat.pk)
+        self.assertEqual(chat_state.state, self.state_target)
+        self.assertEqual({"var": "in_context"}, chat_state.ctx['prev_state'])
+        self.assertIn('state1', chat_state.ctx)
         
     def test_get_with_emoji(self):
         Author.objects.create(name="author1")
@@ -853,8 +873,8 @@ class TestKikRequests(LiveServerTestCase, testcases.KikTestBot):
         with mock.patch('kik.api.KikApi.verify_signature', callable=mock.MagicMock()) as mock_verify:
             mock_verify.return_value = True
             self._test_message(self.author_get_no_menu)
-            self.assertEqual(KikChatState.objects.get(chat=self.chat).state, self.state_target)
-            state_context = KikChatState.objects.get(chat=self.chat).ctx
+            self.assertEqual(KikChatState.objects.get(chat_key=self.chat.pk).state, self.state_target)
+            state_context = KikChatState.objects.get(chat_key=self.chat.pk).ctx
             self.assertEqual(state_context['state1']['pattern'], {})
             self.assertEqual(state_context['state1']['response']['data'][0], {'name': 'author1'})
             self.assertEqual(None, state_context['state1'].get('service', None))
@@ -1001,8 +1021,8 @@ class TestMessengerRequests(LiveServerTestCase, testcases.MessengerTestBot):
         self.chat_state = factories.MessengerChatStateFactory(chat=self.messenger_text_message.sender,
                                                               state=self.state)
         self._test_message(self.author_get)
-        self.assertEqual(MessengerChatState.objects.get(chat=self.messenger_text_message.sender,).state, self.state_target)
-        state_context = MessengerChatState.objects.get(chat=self.messenger_text_message.sender,).ctx
+        self.assertEqual(MessengerChatState.objects.get(chat_key=self.messenger_text_message.sender).state, self.state_target)
+        state_context = MessengerChatState.objects.get(chat_key=self.messenger_text_message.sender).ctx
         self.assertEqual(state_context['state1']['pattern'], {})
         self.assertEqual(state_context['state1']['response']['data'][0], {'name': 'author1'})
         self.assertEqual(None, state_context['state1'].get('service', None))
@@ -1026,8 +1046,8 @@ class TestMessengerRequests(LiveServerTestCase, testcases.MessengerTestBot):
         self.handler.save()
         
         self._test_message(self.author_get)
-        self.assertEqual(MessengerChatState.objects.get(chat=self.messenger_text_message.sender).state, self.state_target)
-        state_context = MessengerChatState.objects.get(chat=self.messenger_text_message.sender).ctx
+        self.assertEqual(MessengerChatState.objects.get(chat_key=self.messenger_text_message.sender).state, self.state_target)
+        state_context = MessengerChatState.objects.get(chat_key=self.messenger_text_message.sender).ctx
         self.assertEqual(state_context['_start']['pattern'], {})
         self.assertEqual(state_context['_start']['response']['data'][0], {'name': 'author1'})
         self.assertEqual(None, state_context['_start'].get('state_context', None))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from permabots.models import TelegramUpdate, TelegramChatState
+from permabots.test import factories, testcases
+from permabots import batching, ingestion, tasks
+from django.test import override_settings
+from django.core.cache import cache
+from django.db import DatabaseError
+try:
+    from unittest import mock
+except ImportError:
+    import mock  # noqa
+
+
+@override_settings(PERMABOTS_TELEGRAM_FAST_PATH=True)
+class TestTelegramFastPath(testcases.TelegramTestBot):
+
+    no_request = {'in': '/norequest',
+                  'out': {'parse_mode': 'HTML',
+                          'reply_markup': '',
+                          'text': 'Just plain response'
+                          }
+                  }
+
+    def setUp(self):
+        super(TestTelegramFastPath, self).setUp()
+        cache.clear()
+        self.response = factories.ResponseFactory(text_template='Just plain response',
+                                                  keyboard_template='')
+        self.handler = factories.HandlerFactory(bot=self.bot,
+                                                pattern='/norequest',
+                                                response=self.response)
+
+    def test_update_not_stored_by_webhook(self):
+        with mock.patch("permabots.tasks.persist_updates.apply_async", callable=mock.MagicMock()) as mock_persist:
+            with mock.patch(self.send_message_to_patch, callable=mock.MagicMock()) as mock_send:
+                self.set_text(self.no_request['in'], self.message_api)
+                self.client.post(self.webhook_url, self.to_send(self.message_api), **self.kwargs)
+                self.assertBotResponse(mock_send, self.no_request)
+            self.assertEqual(1, mock_persist.call_count)
+        self.assertEqual(0, TelegramUpdate.objects.count())
+
+    def test_update_stored_later(self):
+        self._test_message(self.no_request)
+
+    def test_redelivered_update_stored_once(self):
+        self._test_message(self.no_request)
+        self._test_message(self.no_request)
+
+    def test_chat_state_created(self):
+        self.handler.target_state = factories.StateFactory(bot=self.bot, name="state1")
+        self.handler.save()
+        self._test_message(self.no_request)
+        self.assertEqual(1, TelegramChatState.objects.count())
+
+    def test_updates_buffered_again_when_store_fails(self):
+        with mock.patch("permabots.tasks.persist_updates.apply_async", callable=mock.MagicMock()):
+            with mock.patch(self.send_message_to_patch, callable=mock.MagicMock()):
+                self.set_text(self.no_request['in'], self.message_api)
+                self.client.post(self.webhook_url, self.to_send(self.message_api), **self.kwargs)
+            with mock.patch("permabots.ingestion.persist_updates", side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    tasks.persist_updates()
+        self.assertEqual(0, TelegramUpdate.objects.count())
+        self.assertEqual(1, batching.pending(ingestion.BUFFER, ingestion.BUFFER_KEY))
+        tasks.persist_updates()
+        self.assertEqual(1, TelegramUpdate.objects.count())
+
+    @override_settings(PERMABOTS_PERSIST_MAX_RETRIES=1)
+    def test_updates_discarded_after_max_retries(self):
+        with mock.patch("permabots.tasks.persist_updates.apply_async", callable=mock.MagicMock()):
+            with mock.patch(self.send_message_to_patch, callable=mock.MagicMock()):
+                self.set_text(self.no_request['in'], self.message_api)
+                self.client.post(self.webhook_url, self.to_send(self.message_api), **self.kwargs)
+            with mock.patch("permabots.ingestion.persist_updates", side_effect=RuntimeError):
+                for _ in range(2):
+                    with self.assertRaises(RuntimeError):
+                        tasks.persist_updates()
+        self.assertEqual(0, batching.pending(ingestion.BUFFER, ingestion.BUFFER_KEY))
+
+    def test_failing_update_not_blocking_others(self):
+        with mock.patch("permabots.tasks.persist_updates.apply_async", callable=mock.MagicMock()):
+            with mock.patch(self.send_message_to_patch, callable=mock.MagicMock()):
+                self.set_text(self.no_request['in'], self.message_api)
+                self.client.post(self.webhook_url, self.to_send(self.message_api), **self.kwargs)
+                bad_update_id = self.message_api.update_id
+                self.message_api.update_id += 1
+                self.client.post(self.webhook_url, self.to_send(self.message_api), **self.kwargs)
+        save = TelegramUpdate.save
+
+        def failing_save(update, *args, **kwargs):
+            if update.update_id == bad_update_id:
+                raise DatabaseError("Bad update")
+            return save(update, *args, **kwargs)
+        with mock.patch.object(TelegramUpdate.objects, 'bulk_create', side_effect=DatabaseError("Bad update")):
+            with mock.patch.object(TelegramUpdate, 'save', autospec=True, side_effect=failing_save):
+                tasks.persist_updates()
+        self.assertEqual([self.message_api.update_id], list(TelegramUpdate.objects.values_list('update_id', flat=True)))
+        self.assertEqual(0, batching.pending(ingestion.BUFFER, ingestion.BUFFER_KEY))
+
+    @override_settings(PERMABOTS_PERSIST_BATCH_SIZE=2)
+    def test_updates_stored_when_batch_is_full(self):
+        with mock.patch("permabots.tasks.persist_updates.apply_async", callable=mock.MagicMock()) as mock_persist:
+            with mock.patch(self.send_message_to_patch, callable=mock.MagicMock()):
+                self.set_text(self.no_request['in'], self.message_api)
+                self.client.post(self.webhook_url, self.to_send(self.message_api), **self.kwargs)
+                self.assertIn('countdown', mock_persist.call_args[1])
+                self.message_api.update_id += 1
+                self.client.post(self.webhook_url, self.to_send(self.message_api), **self.kwargs)
+                self.assertNotIn('countdown', mock_persist.call_args[1])
+            self.assertEqual(2, mock_persist.call_count)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from django.test import TransactionTestCase
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.contrib.auth import get_user_model
+
+
+class TestChatStateMigration(TransactionTestCase):
+    before = [('permabots', '0011_statecontext')]
+    after = [('permabots', '0014_chatstate_proxies')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def setUp(self):
+        super(TestChatStateMigration, self).setUp()
+        apps = self.migrate(self.before)
+        Bot = apps.get_model('permabots', 'Bot')
+        State = apps.get_model('permabots', 'State')
+        owner = apps.get_model(get_user_model()._meta.app_label, get_user_model()._meta.model_name).objects.create(username='owner')
+        self.bot = Bot.objects.create(owner_id=owner.pk, name='bot')
+        self.state = State.objects.create(bot=self.bot, name='state')
+        telegram_chat = apps.get_model('permabots', 'Chat').objects.create(id=1, type='private')
+        telegram_user = apps.get_model('permabots', 'User').objects.create(id=2, first_name='first')
+        kik_chat = apps.get_model('permabots', 'KikChat').objects.create(id='kikchat')
+        kik_user = apps.get_model('permabots', 'KikUser').objects.create(username='kikuser')
+        apps.get_model('permabots', 'TelegramChatState').objects.create(chat=telegram_chat, user=telegram_user, state=self.state)
+        apps.get_model('permabots', 'KikChatState').objects.create(chat=kik_chat, user=kik_user, state=self.state)
+        apps.get_model('permabots', 'MessengerChatState').objects.create(chat='sender', state=self.state)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        self.migrate(executor.loader.graph.leaf_nodes('permabots'))
+        super(TestChatStateMigration, self).tearDown()
+
+    def test_forward_and_back(self):
+        apps = self.migrate(self.after)
+        ChatState = apps.get_model('permabots', 'ChatState')
+        self.assertEqual(set([('telegram', '1', '2'), ('kik', 'kikchat', 'kikuser'), ('messenger', 'sender', '')]),
+                         set(ChatState.objects.filter(bot_id=self.bot.pk).values_list('service', 'chat_key', 'user_key')))
+        apps = self.migrate(self.before)
+        self.assertEqual([(1, 2)], list(apps.get_model('permabots', 'TelegramChatState').objects.values_list('chat_id', 'user_id')))
+        KikChatState = apps.get_model('permabots', 'KikChatState')
+        self.assertEqual([('kikchat', 'kikuser')], list(KikChatState.objects.values_list('chat_id', 'user_id')))
+        self.assertEqual(['sender'], list(apps.get_model('permabots', 'MessengerChatState').objects.values_list('chat', flat=True)))
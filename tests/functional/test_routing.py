@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from permabots.test import factories, testcases
+from permabots import routing
+
+
+class TestRoutingTable(testcases.BaseTestBot):
+
+    def test_table_reused_while_no_changes(self):
+        factories.HandlerFactory(bot=self.bot, pattern='/authors')
+        table = routing.get_table(self.bot)
+        self.assertIs(table, routing.get_table(self.bot))
+
+    def test_table_rebuilt_when_handler_changes(self):
+        handler = factories.HandlerFactory(bot=self.bot, pattern='/authors')
+        table = routing.get_table(self.bot)
+        handler.pattern = '/books'
+        handler.save()
+        new_table = routing.get_table(self.bot)
+        self.assertIsNot(table, new_table)
+        self.assertIsNone(new_table.resolve(None, '/authors'))
+        self.assertEqual(handler, new_table.resolve(None, '/books')[0])
+
+    def test_table_rebuilt_when_source_states_change(self):
+        handler = factories.HandlerFactory(bot=self.bot, pattern='/authors')
+        state = factories.StateFactory(bot=self.bot)
+        self.assertEqual(handler, routing.get_table(self.bot).resolve(None, '/authors')[0])
+        handler.source_states.add(state)
+        table = routing.get_table(self.bot)
+        self.assertIsNone(table.resolve(None, '/authors'))
+        self.assertEqual(handler, table.resolve(state, '/authors')[0])
+
+    def test_priority_order(self):
+        factories.HandlerFactory(bot=self.bot, pattern='/authors', priority=1)
+        handler_priority = factories.HandlerFactory(bot=self.bot, pattern='/authors', priority=2)
+        self.assertEqual(handler_priority, routing.get_table(self.bot).resolve(None, '/authors')[0])
+
+    def test_pattern_kwargs(self):
+        factories.HandlerFactory(bot=self.bot, pattern=r'/authors@(?P<id>\d+)')
+        handler, kwargs = routing.get_table(self.bot).resolve(None, '/authors@12')
+        self.assertEqual({'id': '12'}, kwargs)
+
+    def test_disabled_handler_not_routed(self):
+        factories.HandlerFactory(bot=self.bot, pattern='/authors', enabled=False)
+        self.assertIsNone(routing.get_table(self.bot).resolve(None, '/authors'))
+
+    def test_handlers_combined_in_one_route(self):
+        factories.HandlerFactory(bot=self.bot, pattern=r'/authors@(?P<id>\d+)', priority=3)
+        handler_books = factories.HandlerFactory(bot=self.bot, pattern=r'/books@(?P<id>\d+)', priority=2)
+        factories.HandlerFactory(bot=self.bot, pattern='/books', priority=1)
+        table = routing.get_table(self.bot)
+        self.assertEqual(1, len(table.routes[None]))
+        self.assertIsInstance(table.routes[None][0], routing.CombinedRoute)
+        self.assertEqual((handler_books, {'id': '7'}), table.resolve(None, '/books@7'))
+
+    def test_combined_keeps_priority_over_position(self):
+        handler_priority = factories.HandlerFactory(bot=self.bot, pattern='world', priority=2)
+        factories.HandlerFactory(bot=self.bot, pattern='hello', priority=1)
+        self.assertEqual(handler_priority, routing.get_table(self.bot).resolve(None, 'hello world')[0])
+
+    def test_backreference_pattern_not_combined(self):
+        factories.HandlerFactory(bot=self.bot, pattern='/authors', priority=3)
+        handler = factories.HandlerFactory(bot=self.bot, pattern='(a)\\1', priority=2)
+        factories.HandlerFactory(bot=self.bot, pattern='/books', priority=1)
+        table = routing.get_table(self.bot)
+        self.assertEqual(3, len(table.routes[None]))
+        self.assertEqual(handler, table.resolve(None, 'aa')[0])
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from django.test import TestCase, override_settings
+from permabots import sessions
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+import threading
+try:
+    from unittest import mock
+except ImportError:
+    import mock  # noqa
+
+
+class CookieHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.cookies.append(self.headers.get('Cookie'))
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'sessionid=%s; Path=/' % self.path.strip('/'))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSessions(TestCase):
+
+    def test_session_reused_for_same_host(self):
+        session = sessions.get_session('https://api.github.com/users/jlmadurga')
+        self.assertIs(session, sessions.get_session('https://api.github.com/repos/jlmadurga/permabots'))
+
+    def test_session_by_host(self):
+        session = sessions.get_session('https://api.github.com/users/jlmadurga')
+        self.assertIsNot(session, sessions.get_session('https://example.com/users/jlmadurga'))
+        self.assertIsNot(session, sessions.get_session('http://api.github.com/users/jlmadurga'))
+
+    def test_sessions_not_shared_after_fork(self):
+        session = sessions.get_session('https://api.github.com/users/jlmadurga')
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIsNot(session, sessions.get_session('https://api.github.com/users/jlmadurga'))
+
+    @override_settings(PERMABOTS_HTTP_POOL_SIZE=3, PERMABOTS_HTTP_MAX_RETRIES=2)
+    def test_session_settings(self):
+        adapter = sessions.create_session().get_adapter('https://api.github.com')
+        self.assertEqual(3, adapter._pool_maxsize)
+        self.assertEqual(2, adapter.max_retries.total)
+
+    @override_settings(PERMABOTS_HTTP_CONNECT_TIMEOUT=2, PERMABOTS_HTTP_READ_TIMEOUT=10)
+    def test_request_timeout(self):
+        with mock.patch('requests.Session.request', callable=mock.MagicMock()) as mock_request:
+            sessions.request('GET', 'https://api.github.com/users/jlmadurga')
+            args, kwargs = mock_request.call_args
+            self.assertEqual((2, 10), kwargs['timeout'])
+
+    @override_settings(PERMABOTS_HTTP_MAX_PER_BOT=2, PERMABOTS_HTTP_MAX_PER_HOST=1)
+    def test_concurrency_limits(self):
+        def check_limits(*args, **kwargs):
+            self.assertFalse(sessions.get_semaphore('host', 'https://api.github.com', 1).acquire(False))
+            bot_semaphore = sessions.get_semaphore('bot', 'bot_id', 2)
+            self.assertTrue(bot_semaphore.acquire(False))
+            self.assertFalse(bot_semaphore.acquire(False))
+            bot_semaphore.release()
+        with mock.patch('requests.Session.request', side_effect=check_limits) as mock_request:
+            sessions.request('GET', 'https://api.github.com/users/jlmadurga', bot_id='bot_id')
+            self.assertEqual(1, mock_request.call_count)
+        self.assertTrue(sessions.get_semaphore('host', 'https://api.github.com', 1).acquire(False))
+
+    def test_cookies_not_shared(self):
+        server = HTTPServer(('127.0.0.1', 0), CookieHandler)
+        server.cookies = []
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%s/' % server.server_port
+            sessions.request('GET', url + 'bot1', bot_id='bot1')
+            sessions.request('GET', url + 'bot2', bot_id='bot2')
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual([None, None], server.cookies)
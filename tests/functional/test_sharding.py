@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from permabots.test import testcases
+from permabots import sharding
+from django.test import override_settings
+from rest_framework import status
+try:
+    from unittest import mock
+except ImportError:
+    import mock  # noqa
+
+
+class TestSharding(testcases.TelegramTestBot):
+
+    def test_disabled(self):
+        self.assertEqual(None, sharding.get_queue('telegram:1:1'))
+
+    @override_settings(PERMABOTS_CHAT_SHARDS=4)
+    def test_same_chat_same_queue(self):
+        queue = sharding.get_queue('telegram:1:1')
+        self.assertEqual(queue, sharding.get_queue('telegram:1:1'))
+        self.assertIn(queue, ['permabots.shard.%d' % shard for shard in range(4)])
+
+    @override_settings(PERMABOTS_CHAT_SHARDS=4)
+    def test_update_sent_to_chat_queue(self):
+        with mock.patch("permabots.tasks.handle_update.apply_async", callable=mock.MagicMock()) as mock_handle:
+            response = self.client.post(self.webhook_url, self.to_send(self.message_api), **self.kwargs)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            args, kwargs = mock_handle.call_args
+            key = 'telegram:%s:%s' % (self.bot.telegram_bot.pk, self.message_api.message.chat.id)
+            self.assertEqual(sharding.get_queue(key), kwargs['queue'])
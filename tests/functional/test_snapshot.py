@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from permabots.models import EnvironmentVar
+from permabots.test import factories, testcases
+from permabots import snapshot, caching
+from django.core.cache import cache
+from django.db.models import Model
+
+
+class TestBotSnapshot(testcases.BaseTestBot):
+
+    def setUp(self):
+        super(TestBotSnapshot, self).setUp()
+        cache.clear()
+        self.state = factories.StateFactory(bot=self.bot)
+        self.handler = factories.HandlerFactory(bot=self.bot, target_state=self.state)
+        self.handler.source_states.add(self.state)
+        self.url_param = factories.UrlParamFactory(request=self.handler.request)
+        EnvironmentVar.objects.create(bot=self.bot, key='shop', value='bookshop')
+
+    def test_configuration(self):
+        bot_snapshot = snapshot.get(self.bot)
+        self.assertEqual([self.handler], list(bot_snapshot.handlers))
+        self.assertEqual(frozenset([self.state.pk]), bot_snapshot.source_states[self.handler.pk])
+        self.assertEqual({'shop': 'bookshop'}, bot_snapshot.env)
+        with self.assertNumQueries(0):
+            handler = bot_snapshot.handlers[0]
+            self.assertEqual(self.handler.response, handler.response)
+            self.assertEqual(self.state, handler.target_state)
+            self.assertEqual([self.url_param], handler.request._params('url_parameters'))
+            self.assertEqual([], handler.request._params('header_parameters'))
+
+    def test_read_once(self):
+        snapshot.get(self.bot)
+        with self.assertNumQueries(0):
+            self.assertEqual([self.handler], list(snapshot.get(self.bot).handlers))
+
+    def test_dumped_without_model_instances(self):
+        def instances(data):
+            if isinstance(data, Model):
+                return 1
+            if isinstance(data, (tuple, list)):
+                return sum(instances(item) for item in data)
+            if isinstance(data, dict):
+                return sum(instances(item) for item in data.values())
+            return 0
+        snapshot.get(self.bot)
+        data = cache.get(caching.generate_key(self.bot._meta.model, self.bot.pk, 'snapshot'))
+        self.assertEqual(0, instances(data))
+
+    def test_rebuilt_when_configuration_changes(self):
+        version = snapshot.get(self.bot).version
+        self.url_param.value_template = '{{ env.shop }}'
+        self.url_param.save()
+        bot_snapshot = snapshot.get(self.bot)
+        self.assertNotEqual(version, bot_snapshot.version)
+        self.assertEqual('{{ env.shop }}', bot_snapshot.handlers[0].request._params('url_parameters')[0].value_template)
+
+    def test_disabled_handlers_not_included(self):
+        self.handler.enabled = False
+        self.handler.save()
+        self.assertEqual((), snapshot.get(self.bot).handlers)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from django.test import TestCase, override_settings
+from permabots.test import factories
+from permabots import templating, utils
+try:
+    from unittest import mock
+except ImportError:
+    import mock  # noqa
+
+
+class TestTemplateCache(TestCase):
+
+    def setUp(self):
+        self.response = factories.ResponseFactory(text_template='<b>{{ pattern.name }}</b>',
+                                                  keyboard_template='')
+
+    def test_template_compiled_once(self):
+        template = templating.get_template(self.response, self.response.text_template)
+        self.assertIs(template, templating.get_template(self.response, self.response.text_template))
+        self.assertEqual('<b>author</b>', self.response.process(pattern={'name': 'author'})[0])
+
+    def test_template_invalidated_on_save(self):
+        template = templating.get_template(self.response, self.response.text_template)
+        self.response.save()
+        self.assertIsNot(template, templating.get_template(self.response, self.response.text_template))
+
+    def test_template_changed(self):
+        templating.get_template(self.response, self.response.text_template)
+        self.response.text_template = '<i>{{ pattern.name }}</i>'
+        self.assertEqual('<i>author</i>', self.response.process(pattern={'name': 'author'})[0])
+
+    @override_settings(PERMABOTS_TEMPLATE_CACHE_SIZE=1)
+    def test_least_recently_used_evicted(self):
+        other_response = factories.ResponseFactory(text_template='other', keyboard_template='')
+        template = templating.get_template(self.response, self.response.text_template)
+        templating.get_template(other_response, other_response.text_template)
+        self.assertIsNot(template, templating.get_template(self.response, self.response.text_template))
+
+    def test_bytecode_stored_on_save(self):
+        bytecode_cache = templating.get_bytecode_cache()
+        bucket = bytecode_cache.get_bucket(templating.env, templating.template_name(self.response, self.response.text_template), None,
+                                           self.response.text_template)
+        self.assertIsNotNone(bucket.code)
+
+    def test_bytecode_of_each_template(self):
+        response = factories.ResponseFactory(text_template='<b>{{ pattern.name }}</b>',
+                                             keyboard_template='[["{{ pattern.name }}"]]')
+        templating.invalidate(response)
+        with mock.patch.object(templating.env, 'compile') as mock_compile:
+            templating.get_template(response, response.text_template)
+            templating.get_template(response, response.keyboard_template)
+            self.assertEqual(0, mock_compile.call_count)
+
+    @override_settings(PERMABOTS_TEMPLATE_BYTECODE_CACHE=None)
+    def test_bytecode_cache_disabled(self):
+        self.assertIsNone(templating.get_bytecode_cache())
+        self.assertEqual('<b>author</b>', self.response.process(pattern={'name': 'author'})[0])
+
+    def test_emoji_global(self):
+        response = factories.ResponseFactory(text_template='{{ emoji.pile_of_poo }}', keyboard_template='')
+        self.assertEqual(u'\U0001F4A9', response.process()[0])
+        self.assertIs(utils.create_emoji_context(), utils.create_emoji_context())
@@ -14,4 +14,5 @@ urlpatterns = [
     url(r'^api/', include(router.urls)),
     url(r'^permabots/api/', include('permabots.urls_api', namespace="api")),
     url(r'^process/', include('permabots.urls_processing', namespace="permabots")),
+    url(r'^permabots/', include('permabots.urls_metrics', namespace="metrics")),
 ]
\ No newline at end of file